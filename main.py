@@ -1,15 +1,32 @@
 """
 FastAPI application entry point
 """
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from src.api.routes import router
 from src.api.websocket_routes import router as websocket_router
+from src.services.http_client import close_http_client
+from src.services.workflow_service import workflow_service
+from src.utils.logging_config import setup_logging, shutdown_logging
+
+setup_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Let queued backend sends finish, then release pooled connections and flush queued logs
+    await workflow_service.wait_for_pending_sends()
+    await close_http_client()
+    shutdown_logging()
+
 
 app = FastAPI(
     title="AI Workflow Generator",
     description="Generate functional requirements, PRD, time estimates, and cost estimates",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -1,14 +1,16 @@
 """
 Pydantic models for API request/response
 """
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from pydantic.dataclasses import dataclass
+from typing import Optional, Dict, Any
 
 
-class GenerateRequest(BaseModel):
-    appName: str = None
-    problemSolved: str = None
-    coreFeatures: str = None
+# Slotted, frozen dataclasses: no per-instance __dict__ on the hot /generate path
+@dataclass(slots=True, frozen=True)
+class GenerateRequest:
+    appName: Optional[str] = None
+    problemSolved: Optional[str] = None
+    coreFeatures: Optional[str] = None
     frontendStack: Optional[str] = None
     backendStack: Optional[str] = None
     programmingLanguage: Optional[str] = None
@@ -24,7 +26,8 @@ class GenerateRequest(BaseModel):
     num_developers: Optional[int] = None
 
 
-class GenerateResponse(BaseModel):
+@dataclass(slots=True, frozen=True)
+class GenerateResponse:
     functional_requirements: str
     prd: str
     time_estimates: Dict[str, Any]
@@ -1,18 +1,39 @@
 """
 WebSocket routes for interactive data collection
 """
-import json
-import asyncio
+import logging
+from enum import Enum
+from typing import Optional, Tuple
+import orjson
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from src.services.session_manager import session_manager
 from src.services.response_validator import ResponseValidator
-from src.services.question_service import QuestionService
-from src.services.workflow_service import WorkflowService
+from src.services.question_service import QuestionService, REQUIRED_FIELDS
+from src.services.workflow_service import workflow_service
+
+logger = logging.getLogger(__name__)
+
 
 router = APIRouter()
 validator = ResponseValidator()
 question_service = QuestionService()
-workflow_service = WorkflowService()
+
+
+def _debug_tracebacks() -> bool:
+    """Only format full tracebacks for handled errors when debug logging is on (LOG_LEVEL=DEBUG)"""
+    return logger.isEnabledFor(logging.DEBUG)
+
+
+async def _send(websocket: WebSocket, payload: dict):
+    """Send a JSON message, encoded with orjson, as a text frame"""
+    await websocket.send_text(orjson.dumps(payload).decode())
+
+
+class TurnState(Enum):
+    """Where the conversation is within the current question"""
+    WAITING_QUESTION = "waiting_question"  # Current field is settled; ask the next one
+    WAITING_RESPONSE = "waiting_response"  # Question sent, waiting for the answer
+    WAITING_FOLLOWUP = "waiting_followup"  # Follow-up sent, waiting for the clarified answer
 
 
 @router.websocket("/ws/collect")
@@ -22,7 +43,7 @@ async def websocket_collect(websocket: WebSocket):
     
     Flow:
     1. Client connects, receives session_id
-    2. Server asks first question
+    2. Server asks first question (streamed as "question_delta" messages, then the full "question")
     3. Client responds
     4. Server validates response
     5. If unsatisfactory, ask follow-up (max 1 follow-up per question)
@@ -34,318 +55,282 @@ async def websocket_collect(websocket: WebSocket):
     
     # Create new session
     session_id = session_manager.create_session()
+    # Bind the session once; the loop reads and mutates it directly
+    session = session_manager.get_session(session_id)
     
-    # Keepalive task to send ping every 30 seconds
-    async def keepalive():
-        while True:
-            await asyncio.sleep(30)
-            try:
-                await websocket.send_json({"type": "ping"})
-            except:
-                break
+    state = TurnState.WAITING_QUESTION
+    next_field = None
+    current_question = None  # Track the current question (original or follow-up)
     
-    keepalive_task = asyncio.create_task(keepalive())
+    async def _accept(field: str, text: str, message: str = "Thank you! I've saved that information."):
+        """Save the response for a field and confirm it to the client"""
+        session.update_field(field, text)
+        await _send(websocket, {
+            "type": "accepted",
+            "field": field,
+            "message": message,
+            "session_id": session_id
+        })
     
-    try:
-        # Send session ID and welcome message
-        await websocket.send_json({
-            "type": "session_started",
-            "session_id": session_id,
-            "message": "Welcome! I'll help you collect information about your project. Let's start!"
+    async def _follow_up(question: str):
+        """Send a follow-up question for the current field"""
+        nonlocal state, current_question
+        await _send(websocket, {
+            "type": "follow_up",
+            "field": next_field,
+            "question": question,
+            "session_id": session_id
         })
+        session.increment_follow_up(next_field)
+        current_question = question  # Update current question to the follow-up
+        state = TurnState.WAITING_FOLLOWUP
+    
+    async def _next_turn(drafted: Optional[Tuple[str, str]] = None) -> bool:
+        """
+        Ask the next question, or run the workflow once collection is complete
         
-        # Main conversation loop
-        while True:
-            # Get collected data
-            session = session_manager.get_session(session_id)
-            if not session:
-                await websocket.send_json({
-                    "type": "error",
-                    "message": "Session not found"
-                })
-                break
-            
-            # Get skipped fields
-            skipped_fields = session.skipped_fields.copy() if hasattr(session, 'skipped_fields') else set()
-            
-            # Check if all fields are complete using question service
-            # Use full session.data to include empty strings for skipped fields
-            is_done = question_service.is_complete(session.data, skipped_fields)
+        Args:
+            drafted: (field, question) drafted during the previous turn's validation call;
+                used instead of generating a new question when it is for the next field
+        
+        Returns:
+            False when the conversation is over, True while waiting for a response
+        """
+        nonlocal state, next_field, current_question
+        skipped_fields = session.skipped_fields
+        
+        # Check if all fields are complete using the session's next-field pointer
+        if question_service.is_complete(session.next_field_index):
+            logger.debug("✅ All fields complete! Starting workflow...")
+            logger.debug("   Collected fields: %s", [k for k, v in session.data.items() if v])
+            logger.debug("   Skipped fields: %s", skipped_fields)
             
-            # Debug logging
-            if is_done:
-                print(f"✅ All fields complete! Starting workflow...")
-                print(f"   Collected fields: {[k for k, v in session.data.items() if v]}")
-                print(f"   Skipped fields: {skipped_fields}")
+            # All done collecting data!
+            data = session.data.copy()
+            logger.debug("📊 Collected data keys: %s", list(data.keys()))
             
-            if is_done:
-                # All done collecting data!
-                data = session_manager.get_data(session_id)
-                print(f"📊 Collected data keys: {list(data.keys())}")
+            try:
+                await _send(websocket, {
+                    "type": "complete",
+                    "message": "Thank you! I've collected all the necessary information. Now generating TRD, time and cost estimates...",
+                    "data": data
+                })
+                logger.debug("✅ Sent 'complete' message")
                 
-                try:
-                    await websocket.send_json({
-                        "type": "complete",
-                        "message": "Thank you! I've collected all the necessary information. Now generating TRD, time and cost estimates...",
-                        "data": data
+                # Execute workflow in background
+                await _send(websocket, {
+                    "type": "workflow_started",
+                    "message": "Starting workflow generation..."
+                })
+                logger.debug("✅ Sent 'workflow_started' message")
+                
+                logger.debug("🔄 Executing workflow...")
+                workflow_result = await workflow_service.execute_workflow(data)
+                logger.debug("✅ Workflow result: success=%s", workflow_result.get('success'))
+                
+                if workflow_result["success"]:
+                    # Send workflow results
+                    await _send(websocket, {
+                        "type": "workflow_complete",
+                        "message": "Workflow completed successfully!",
+                        "trd": workflow_result["trd"],
+                        "time_estimate": workflow_result["time_estimate"],
+                        "cost_estimate": workflow_result["cost_estimate"],
+                        "backend_status": workflow_result["backend_status"]
                     })
-                    print("✅ Sent 'complete' message")
-                    
-                    # Execute workflow in background
-                    await websocket.send_json({
-                        "type": "workflow_started",
-                        "message": "Starting workflow generation..."
+                    logger.debug("✅ Sent 'workflow_complete' message")
+                else:
+                    # Workflow failed
+                    error_msg = workflow_result.get('error', 'Unknown error')
+                    logger.error("❌ Workflow failed: %s", error_msg)
+                    await _send(websocket, {
+                        "type": "workflow_error",
+                        "message": f"Workflow generation failed: {error_msg}",
+                        "error": error_msg
                     })
-                    print("✅ Sent 'workflow_started' message")
-                    
-                    print("🔄 Executing workflow...")
-                    workflow_result = await workflow_service.execute_workflow(data)
-                    print(f"✅ Workflow result: success={workflow_result.get('success')}")
                     
-                    if workflow_result["success"]:
-                        # Send workflow results
-                        await websocket.send_json({
-                            "type": "workflow_complete",
-                            "message": "Workflow completed successfully!",
-                            "trd": workflow_result["trd"],
-                            "time_estimate": workflow_result["time_estimate"],
-                            "cost_estimate": workflow_result["cost_estimate"],
-                            "backend_status": workflow_result["backend_status"]
-                        })
-                        print("✅ Sent 'workflow_complete' message")
-                    else:
-                        # Workflow failed
-                        error_msg = workflow_result.get('error', 'Unknown error')
-                        print(f"❌ Workflow failed: {error_msg}")
-                        await websocket.send_json({
-                            "type": "workflow_error",
-                            "message": f"Workflow generation failed: {error_msg}",
-                            "error": error_msg
-                        })
-                        
-                except Exception as e:
-                    import traceback
-                    error_msg = f"Error executing workflow: {str(e)}"
-                    print(f"❌ Workflow error: {error_msg}")
-                    print(traceback.format_exc())
-                    try:
-                        await websocket.send_json({
-                            "type": "workflow_error",
-                            "message": error_msg,
-                            "error": str(e)
-                        })
-                    except Exception as send_error:
-                        print(f"❌ Could not send error message: {str(send_error)}")
-                
-                break
-            
-            # Use question service to determine what to ask next
-            # Pass skipped fields to never ask them again
-            next_field = question_service.get_next_field_to_ask(session.data, skipped_fields)
-            
-            if next_field is None:
-                # Should not happen if is_complete check worked, but handle it
-                await websocket.send_json({
-                    "type": "error",
-                    "message": "Unable to determine next question. Please try again."
-                })
-                break
-            
-            # Generate question using OpenAI
-            session.current_question = next_field
-            # Get context of already filled fields
-            context = {k: v for k, v in session.data.items() if v is not None}
-            question = await question_service.generate_question(next_field, context)
+            except Exception as e:
+                error_msg = f"Error executing workflow: {str(e)}"
+                logger.error("❌ Workflow error: %s", error_msg, exc_info=_debug_tracebacks())
+                try:
+                    await _send(websocket, {
+                        "type": "workflow_error",
+                        "message": error_msg,
+                        "error": str(e)
+                    })
+                except Exception as send_error:
+                    logger.error("❌ Could not send error message: %s", send_error)
             
-            await websocket.send_json({
-                "type": "question",
-                "field": next_field,
-                "question": question,
-                "session_id": session_id
+            return False
+        
+        # Use question service to determine what to ask next
+        # Pass skipped fields to never ask them again
+        next_field = question_service.get_next_field_to_ask(
+            session.data, skipped_fields, session.next_field_index
+        )
+        
+        if next_field is None:
+            # Should not happen if is_complete check worked, but handle it
+            await _send(websocket, {
+                "type": "error",
+                "message": "Unable to determine next question. Please try again."
             })
+            return False
+        
+        session.current_question = next_field
+        if drafted and drafted[0] == next_field and drafted[1]:
+            current_question = drafted[1]
+        else:
+            async def _send_delta(delta: str):
+                await _send(websocket, {
+                    "type": "question_delta",
+                    "field": next_field,
+                    "delta": delta,
+                    "session_id": session_id
+                })
             
-            # Handle responses for this question (including follow-ups)
-            question_answered = False
-            current_question = question  # Track the current question (original or follow-up)
-            while not question_answered:
-                try:
-                    data = await websocket.receive_json()
-                    
-                    # Handle ping/pong for keepalive
-                    if data.get("type") == "pong":
-                        continue  # Just acknowledge, don't process
+            # Generate question using OpenAI, streaming fragments to the client as they arrive;
+            # the "question" message below carries the final text
+            # Context of already filled fields is maintained by the session manager
+            current_question = await question_service.generate_question(
+                next_field, session.filled_context, on_delta=_send_delta
+            )
+        
+        await _send(websocket, {
+            "type": "question",
+            "field": next_field,
+            "question": current_question,
+            "session_id": session_id
+        })
+        state = TurnState.WAITING_RESPONSE
+        return True
+    
+    try:
+        # Send session ID and welcome message
+        await _send(websocket, {
+            "type": "session_started",
+            "session_id": session_id,
+            "message": "Welcome! I'll help you collect information about your project. Let's start!"
+        })
+        
+        if not await _next_turn():
+            return
+        
+        # Single receive loop; iter_text ends cleanly when the client disconnects
+        async for message in websocket.iter_text():
+            # Each client message refreshes the session's TTL, so only idle sessions expire
+            session_manager.touch(session_id)
+            drafted = None
+            try:
+                data = orjson.loads(message)
+                message_type = data.get("type")
+                
+                if message_type == "response":
+                    response_text = data.get("response", "").strip()
                     
-                    if data.get("type") == "response":
-                        response_text = data.get("response", "").strip()
-                        
-                        if not response_text:
-                            # Empty response, ask follow-up
-                            follow_up_count = session_manager.get_follow_up_count(session_id, next_field)
-                            if follow_up_count < 2:
-                                # Generate follow-up question using OpenAI
-                                follow_up_question = await question_service.generate_follow_up_question(
-                                    current_question, response_text, next_field
-                                )
-                                await websocket.send_json({
-                                    "type": "follow_up",
-                                    "field": next_field,
-                                    "question": follow_up_question,
-                                    "session_id": session_id
-                                })
-                                session_manager.increment_follow_up(session_id, next_field)
-                                current_question = follow_up_question  # Update current question to the follow-up
-                                # Stay in loop to wait for follow-up response
-                                continue
-                            else:
-                                # Already asked 2 follow-ups, accept empty and move on
-                                session_manager.update_field(session_id, next_field, "")
-                                await websocket.send_json({
-                                    "type": "accepted",
-                                    "field": next_field,
-                                    "message": "Moving on to the next question.",
-                                    "session_id": session_id
-                                })
-                                question_answered = True
-                                break
-                        
-                        # Validate response
+                    if not response_text:
+                        # Empty response, ask follow-up without an LLM call
+                        if session.follow_up_count.get(next_field, 0) < 2:
+                            await _follow_up(validator.non_answer_follow_up(next_field))
+                        else:
+                            # Already asked 2 follow-ups, accept empty and move on
+                            await _accept(next_field, "", "Moving on to the next question.")
+                            state = TurnState.WAITING_QUESTION
+                    elif validator.quick_accept(response_text, next_field):
+                        # Obvious answers are accepted without an LLM call
+                        await _accept(next_field, response_text)
+                        state = TurnState.WAITING_QUESTION
+                    elif validator.quick_reject(response_text, next_field):
+                        # Non-answers like "idk" are rejected without an LLM call
+                        if session.follow_up_count.get(next_field, 0) < 2:
+                            await _follow_up(validator.non_answer_follow_up(next_field))
+                        else:
+                            await _accept(next_field, response_text)
+                            state = TurnState.WAITING_QUESTION
+                    else:
+                        # Validate the response and draft the next question in one LLM call
+                        upcoming_field = question_service.peek_next_field(
+                            session.data, session.skipped_fields, next_field, session.next_field_index
+                        )
                         try:
-                            is_satisfactory, follow_up_question = await validator.is_response_satisfactory(
-                                current_question, response_text, next_field
+                            is_satisfactory, follow_up_question, next_question = await question_service.turn_step(
+                                current_question, response_text, next_field, session.filled_context, upcoming_field
                             )
                         except Exception as e:
                             # If validation fails, accept the response and move on
-                            import traceback
-                            print(f"⚠️ Validation error for {next_field}: {str(e)}")
-                            print(traceback.format_exc())
+                            logger.warning("⚠️ Validation error for %s: %s", next_field, e, exc_info=_debug_tracebacks())
                             is_satisfactory = True
                             follow_up_question = None
+                            next_question = None
                         
-                        if is_satisfactory:
-                            # Save the response
-                            session_manager.update_field(session_id, next_field, response_text)
-                            await websocket.send_json({
-                                "type": "accepted",
-                                "field": next_field,
-                                "message": "Thank you! I've saved that information.",
-                                "session_id": session_id
-                            })
-                            question_answered = True
-                        else:
-                            # Response not satisfactory
-                            follow_up_count = session_manager.get_follow_up_count(session_id, next_field)
-                            if follow_up_count < 2:
-                                # Generate follow-up question using OpenAI to clarify
-                                try:
-                                    if follow_up_question:
-                                        follow_up_q = follow_up_question
-                                    else:
-                                        follow_up_q = await question_service.generate_follow_up_question(
-                                            current_question, response_text, next_field
-                                        )
-                                    await websocket.send_json({
-                                        "type": "follow_up",
-                                        "field": next_field,
-                                        "question": follow_up_q,
-                                        "session_id": session_id
-                                    })
-                                    session_manager.increment_follow_up(session_id, next_field)
-                                    current_question = follow_up_q  # Update current question to the follow-up
-                                    # Stay in loop to wait for follow-up response
-                                    continue
-                                except Exception as e:
-                                    # If follow-up generation fails, accept the response and move on
-                                    import traceback
-                                    print(f"⚠️ Follow-up generation error for {next_field}: {str(e)}")
-                                    print(traceback.format_exc())
-                                    session_manager.update_field(session_id, next_field, response_text)
-                                    await websocket.send_json({
-                                        "type": "accepted",
-                                        "field": next_field,
-                                        "message": "Thank you! I've saved that information.",
-                                        "session_id": session_id
-                                    })
-                                    question_answered = True
-                            else:
-                                # Already asked 2 follow-ups, accept the response and move on
-                                session_manager.update_field(session_id, next_field, response_text)
-                                await websocket.send_json({
-                                    "type": "accepted",
-                                    "field": next_field,
-                                    "message": "Thank you! I've saved that information.",
-                                    "session_id": session_id
-                                })
-                                question_answered = True
-                    
-                    elif data.get("type") == "skip":
-                        # User wants to skip this question
-                        # First 3 fields (appName, problemSolved, coreFeatures) cannot be skipped
-                        required_fields = ["appName", "problemSolved", "coreFeatures"]
-                        if next_field in required_fields:
-                            await websocket.send_json({
-                                "type": "error",
-                                "field": next_field,
-                                "message": f"{next_field} is a required field and cannot be skipped. Please provide an answer.",
-                                "session_id": session_id
-                            })
-                            # Don't mark as answered, continue asking
-                            continue
+                        if not is_satisfactory and session.follow_up_count.get(next_field, 0) < 2:
+                            # The clarifying follow-up question comes from the same LLM call
+                            await _follow_up(follow_up_question)
                         else:
-                            # Mark as permanently skipped
-                            session_manager.mark_field_skipped(session_id, next_field)
-                            await websocket.send_json({
-                                "type": "skipped",
-                                "field": next_field,
-                                "message": f"Skipped {next_field} as requested.",
-                                "session_id": session_id
-                            })
-                            question_answered = True
-                    
-                    elif data.get("type") == "cancel":
-                        # User wants to cancel
-                        await websocket.send_json({
-                            "type": "cancelled",
-                            "message": "Session cancelled."
-                        })
-                        return  # Exit the entire function
-                        
-                except WebSocketDisconnect:
-                    return  # Exit the entire function
-                except Exception as e:
-                    import traceback
-                    error_msg = f"Error processing response: {str(e)}"
-                    print(f"❌ WebSocket error: {error_msg}")
-                    print(traceback.format_exc())
-                    try:
-                        await websocket.send_json({
+                            # Satisfactory, or already asked 2 follow-ups: save the response and move on
+                            await _accept(next_field, response_text)
+                            state = TurnState.WAITING_QUESTION
+                            drafted = (upcoming_field, next_question)
+                
+                elif message_type == "skip":
+                    # User wants to skip this question
+                    # First 3 fields (appName, problemSolved, coreFeatures) cannot be skipped
+                    if next_field in REQUIRED_FIELDS:
+                        # Don't mark as answered, keep waiting for an answer
+                        await _send(websocket, {
                             "type": "error",
-                            "message": error_msg
+                            "field": next_field,
+                            "message": f"{next_field} is a required field and cannot be skipped. Please provide an answer.",
+                            "session_id": session_id
+                        })
+                    else:
+                        # Mark as permanently skipped
+                        session.mark_field_skipped(next_field)
+                        await _send(websocket, {
+                            "type": "skipped",
+                            "field": next_field,
+                            "message": f"Skipped {next_field} as requested.",
+                            "session_id": session_id
                         })
-                    except:
-                        pass  # Connection might be closed
-                    question_answered = True  # Move to next question on error
+                        state = TurnState.WAITING_QUESTION
+                
+                elif message_type == "cancel":
+                    # User wants to cancel
+                    await _send(websocket, {
+                        "type": "cancelled",
+                        "message": "Session cancelled."
+                    })
+                    return  # Exit the entire function
+                    
+            except WebSocketDisconnect:
+                return  # Exit the entire function
+            except Exception as e:
+                error_msg = f"Error processing response: {str(e)}"
+                logger.error("❌ WebSocket error: %s", error_msg, exc_info=_debug_tracebacks())
+                try:
+                    await _send(websocket, {
+                        "type": "error",
+                        "message": error_msg
+                    })
+                except:
+                    pass  # Connection might be closed
+                state = TurnState.WAITING_QUESTION  # Move to next question on error
+            
+            if state is TurnState.WAITING_QUESTION and not await _next_turn(drafted):
+                break
     
     except WebSocketDisconnect:
         pass
     except Exception as e:
-        import traceback
         error_msg = f"An error occurred: {str(e)}"
-        print(f"❌ WebSocket outer error: {error_msg}")
-        print(traceback.format_exc())
+        logger.error("❌ WebSocket outer error: %s", error_msg, exc_info=_debug_tracebacks())
         try:
-            await websocket.send_json({
+            await _send(websocket, {
                 "type": "error",
                 "message": error_msg
             })
         except:
             pass
     finally:
-        # Cancel keepalive task
-        keepalive_task.cancel()
-        try:
-            await keepalive_task
-        except asyncio.CancelledError:
-            pass
-        # Clean up session (optional - you might want to keep it for a while)
-        # session_manager.delete_session(session_id)
-
+        # The conversation is over; nothing can reach this session again
+        session_manager.delete_session(session_id)
@@ -2,28 +2,143 @@
 Anthropic Claude service for PRD generation
 """
 import os
-from anthropic import Anthropic
+import asyncio
+import logging
+from typing import Iterable, Optional
+from anthropic import AsyncAnthropic, APIConnectionError, InternalServerError, RateLimitError
 from dotenv import load_dotenv
 from src.utils.prompts import TIME_ESTIMATION_PROMPT
 from src.utils.prompts import COST_ESTIMATION_PROMPT
-from src.utils.prompts import PRD_GENERATION_PROMPT
-import json
+from src.utils.prompts import PRD_PROMPT_PREFIX, PRD_PROMPT_SUFFIX
+from src.utils.prompts import COMBINED_ESTIMATION_PROMPT
+from src.utils.prompts import PRD_SYSTEM_PROMPT
+from src.utils.prompts import ESTIMATION_SYSTEM_PROMPT
+from src.utils.prompts import render_estimation_context_prompt
+from src.utils.prompts import TIME_ESTIMATES_TOOL, COST_ESTIMATES_TOOL, ESTIMATES_TOOL, ESTIMATION_TOOLS
+from src.utils.cache import cached_response
+from src.utils.retry import with_retry_async
+from src.services.http_client import async_http_client
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Collected fields that make up the tech stack passed to the estimates, in display order
+TECH_STACK_FIELDS = ("frontendStack", "backendStack", "programmingLanguage", "database")
+
+
+def format_tech_stack(technologies: Iterable[Optional[str]]) -> str:
+    """Join the provided technologies into the tech stack string used by the estimates"""
+    return ", ".join(filter(None, technologies)) or "Not specified"
+
+
+def _normalize_tech_stack(tech_stack) -> str:
+    """Render a tech stack given as a list of technologies or a prebuilt string"""
+    return ", ".join(tech_stack) if isinstance(tech_stack, list) else tech_stack
+
+
+def _tool_input(message, tool: dict) -> dict:
+    """
+    Return the input the model passed to a forced tool call
+    
+    The SDK has already parsed the tool input into a dict, so there is no text
+    to strip or JSON to decode here. A response cut off by the output token
+    limit is rejected: the streamed input is then only partially built.
+    """
+    if message.stop_reason == "max_tokens":
+        raise ValueError(f"{tool['name']} input was truncated at the output token limit")
+    for block in message.content:
+        if block.type == "tool_use" and block.name == tool["name"]:
+            return block.input
+    raise ValueError(f"Response did not call {tool['name']}")
+
+
+def _tool_choice(tool: dict) -> dict:
+    """Force the model to answer through the given tool"""
+    return {"type": "tool", "name": tool["name"]}
+
+
+# Errors the SDK would itself retry (408/409 are matched by status code in with_retry_async);
+# every request goes through with_retry_async, which retries these
+RETRYABLE_ERRORS = (RateLimitError, InternalServerError, APIConnectionError)
+
+# Cache breakpoint at the end of the system prompt: the tools and system text before it are
+# identical for every estimate call, whatever the PRD. Only tool_choice and the messages
+# vary, and a tool_choice change doesn't invalidate the tools/system part of the cache.
+ESTIMATION_SYSTEM = [
+    {"type": "text", "text": ESTIMATION_SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}
+]
+
+# Output token limits per model, looked up once at init; unlisted models get the Haiku limit
+MODEL_MAX_OUTPUT_TOKENS = {
+    "claude-3-haiku-20240307": 4096,
+    "claude-3-opus-20240229": 4096,
+    "claude-3-5-sonnet-20241022": 8000,
+}
+DEFAULT_MAX_OUTPUT_TOKENS = 4096
+
+# Single time or cost estimate (4000 is safe for all models including Haiku)
+ESTIMATE_MAX_TOKENS = 4000
+
+# A combined time+cost response gets the budget of both separate calls; models whose output
+# limit is lower (e.g. Haiku) would routinely truncate it, so they use the separate calls only
+COMBINED_ESTIMATE_MAX_TOKENS = 2 * ESTIMATE_MAX_TOKENS
+
+
 class ClaudeService:
     def __init__(self):
         api_key = os.getenv("ANTHROPIC_API_KEY")
         if not api_key:
             raise ValueError("ANTHROPIC_API_KEY environment variable is not set")
         
-        self.client = Anthropic(api_key=api_key)
+        # SDK retries are off: _create_message retries with backoff, outside the concurrency limit
+        self.client = AsyncAnthropic(api_key=api_key, http_client=async_http_client, max_retries=0)
         # Use a more standard Claude model name
         # Try claude-3-5-sonnet-20241022 or claude-3-opus-20240229
         self.model = "claude-3-haiku-20240307"  # Claude 3.5 Sonnet (more stable)
-        print(f"Initialized Claude service with model: {self.model}")
+        self.max_output_tokens = MODEL_MAX_OUTPUT_TOKENS.get(self.model, DEFAULT_MAX_OUTPUT_TOKENS)
+        self.combine_estimates = self.max_output_tokens >= COMBINED_ESTIMATE_MAX_TOKENS
+        # Caps in-flight requests from this process so bursts queue here instead of hitting 429s
+        self.limit = asyncio.Semaphore(int(os.getenv("ANTHROPIC_MAX_CONCURRENCY", "8")))
+        logger.info("Initialized Claude service with model: %s", self.model)
+    
+    def _estimation_content(self, prd: str, num_developers: int, tech_stack: list, instructions: str) -> list:
+        """
+        Build estimate message content: the PRD/metadata block, then the instructions
+        
+        Not marked with cache_control: the cached prefix ends at ESTIMATION_SYSTEM,
+        since the message cache is invalidated whenever the forced tool changes.
+        """
+        context = render_estimation_context_prompt(
+            prd=prd,
+            num_developers=num_developers,
+            tech_stack=_normalize_tech_stack(tech_stack)
+        )
+        return [
+            {"type": "text", "text": context},
+            {"type": "text", "text": instructions}
+        ]
+    
+    async def _create_message(self, **kwargs):
+        """
+        Run a messages request over the streaming API and return the final message
+        
+        Nothing consumes tokens early: the stream is drained into the assembled
+        message (content, stop_reason), which callers post-process as before.
+        Streaming keeps data flowing on long PRD generations, so they don't sit
+        on an idle connection until the read timeout. Rate-limited, 5xx and
+        connection failures are retried with exponential backoff.
+        """
+        async def stream_once():
+            # Hold a concurrency slot per attempt only, so backoff sleeps don't block other requests
+            async with self.limit:
+                async with self.client.messages.stream(model=self.model, **kwargs) as stream:
+                    return await stream.get_final_message()
+        
+        return await with_retry_async(stream_once, retry_on=RETRYABLE_ERRORS)
     
-    def generate_prd(self, functional_requirements: str) -> str:
+    @cached_response("prd")
+    async def generate_prd(self, functional_requirements: str) -> str:
         """
         Generate PRD from functional requirements
         
@@ -33,44 +148,37 @@ class ClaudeService:
         Returns:
             PRD as markdown string
         """
-        from src.utils.prompts import PRD_GENERATION_PROMPT
-        
-        prompt = PRD_GENERATION_PROMPT.format(
-            functional_requirements=functional_requirements
-        )
+        prompt = PRD_PROMPT_PREFIX + functional_requirements + PRD_PROMPT_SUFFIX
         
         try:
-            # Claude Haiku has max 4096 tokens, Sonnet/Opus can handle more
-            # Use 4096 to be safe for all models
-            max_output_tokens = 4096 if "haiku" in self.model.lower() else 8000
-            
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=max_output_tokens,
+            message = await self._create_message(
+                max_tokens=self.max_output_tokens,
+                # Too short (~300 tokens) for Claude's minimum cacheable prompt, so not cache_control-marked
+                system=PRD_SYSTEM_PROMPT,
                 messages=[
                     {
                         "role": "user",
                         "content": prompt
                     }
-                ]
+                ],
+                # The PRD is complete at its closing tag; stop there rather than decoding any
+                # trailing commentary, so the estimates can start as soon as the tag is reached
+                stop_sequences=["</PRD>"]
             )
             
             # Extract PRD from response (handle <PRD> tags if present)
             content = message.content[0].text.strip()
             
-            # Remove <PRD> tags if present
-            if content.startswith("<PRD>") and content.endswith("</PRD>"):
-                content = content[5:-6].strip()
-            elif content.startswith("<PRD>"):
-                content = content[5:].strip()
-            elif content.endswith("</PRD>"):
-                content = content[:-6].strip()
+            # Drop anything before the opening <PRD> tag; the closing tag is the stop sequence
+            content = content.partition("<PRD>")[2] or content
+            content = content.removesuffix("</PRD>").strip()
             
             return content
         except Exception as e:
             raise Exception(f"Claude API error: {str(e)}")
     
-    def generate_time_estimates(self, prd: str, num_developers: int, tech_stack: list) -> dict:
+    @cached_response("time_estimates")
+    async def generate_time_estimates(self, prd: str, num_developers: int, tech_stack: list) -> dict:
         """
         Generate time estimates from PRD
         
@@ -84,48 +192,30 @@ class ClaudeService:
         """
         
         
-        prompt = TIME_ESTIMATION_PROMPT.format(
-            prd=prd,
-            num_developers=num_developers,
-            tech_stack=", ".join(tech_stack) if isinstance(tech_stack, list) else tech_stack
-        )
+        message_content = self._estimation_content(prd, num_developers, tech_stack, TIME_ESTIMATION_PROMPT)
         
         try:
-            # Max tokens for estimates (4000 is safe for all models including Haiku)
-            max_output_tokens = 4000
-            
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=max_output_tokens,
+            message = await self._create_message(
+                max_tokens=ESTIMATE_MAX_TOKENS,
+                system=ESTIMATION_SYSTEM,
+                tools=ESTIMATION_TOOLS,
+                tool_choice=_tool_choice(TIME_ESTIMATES_TOOL),
                 messages=[
                     {
                         "role": "user",
-                        "content": prompt
+                        "content": message_content
                     }
                 ]
             )
             
-            content = message.content[0].text.strip()
-            
-            # Remove markdown code blocks if present
-            if content.startswith("```json"):
-                content = content[7:]
-            elif content.startswith("```"):
-                content = content[3:]
-            
-            if content.endswith("```"):
-                content = content[:-3]
-            
-            content = content.strip()
-            
-            # Parse JSON
-            return json.loads(content)
-        except json.JSONDecodeError as e:
-            raise Exception(f"Failed to parse time estimates JSON: {str(e)}")
+            return _tool_input(message, TIME_ESTIMATES_TOOL)
+        except ValueError as e:
+            raise Exception(f"Failed to read time estimates: {str(e)}")
         except Exception as e:
             raise Exception(f"Claude API error: {str(e)}")
     
-    def generate_cost_estimates(self, prd: str, num_developers: int, tech_stack: list) -> dict:
+    @cached_response("cost_estimates")
+    async def generate_cost_estimates(self, prd: str, num_developers: int, tech_stack: list) -> dict:
         """
         Generate cost estimates from PRD
         
@@ -139,44 +229,88 @@ class ClaudeService:
         """
         
         
-        prompt = COST_ESTIMATION_PROMPT.format(
-            prd=prd,
-            num_developers=num_developers,
-            tech_stack=", ".join(tech_stack) if isinstance(tech_stack, list) else tech_stack
-        )
+        message_content = self._estimation_content(prd, num_developers, tech_stack, COST_ESTIMATION_PROMPT)
         
         try:
-            # Max tokens for estimates (4000 is safe for all models including Haiku)
-            max_output_tokens = 4000
-            
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=max_output_tokens,
+            message = await self._create_message(
+                max_tokens=ESTIMATE_MAX_TOKENS,
+                system=ESTIMATION_SYSTEM,
+                tools=ESTIMATION_TOOLS,
+                tool_choice=_tool_choice(COST_ESTIMATES_TOOL),
                 messages=[
                     {
                         "role": "user",
-                        "content": prompt
+                        "content": message_content
                     }
                 ]
             )
             
-            content = message.content[0].text.strip()
-            
-            # Remove markdown code blocks if present
-            if content.startswith("```json"):
-                content = content[7:]
-            elif content.startswith("```"):
-                content = content[3:]
-            
-            if content.endswith("```"):
-                content = content[:-3]
-            
-            content = content.strip()
+            return _tool_input(message, COST_ESTIMATES_TOOL)
+        except ValueError as e:
+            raise Exception(f"Failed to read cost estimates: {str(e)}")
+        except Exception as e:
+            raise Exception(f"Claude API error: {str(e)}")
+    
+    @cached_response("estimates")
+    async def generate_estimates(self, prd: str, num_developers: int, tech_stack: list) -> tuple:
+        """
+        Generate time and cost estimates from PRD, in a single Claude call where possible
+        
+        When the model's output limit covers both estimate budgets, the PRD is sent
+        and processed once instead of twice. Otherwise, or if the combined response
+        is cut off or incomplete, separate time and cost estimate calls are issued
+        concurrently.
+        
+        Args:
+            prd: PRD markdown string
+            num_developers: Number of developers
+            tech_stack: List of technologies
             
-            # Parse JSON
-            return json.loads(content)
-        except json.JSONDecodeError as e:
-            raise Exception(f"Failed to parse cost estimates JSON: {str(e)}")
+        Returns:
+            Tuple of (time estimates dict, cost estimates dict)
+        """
+        # Normalize once; the separate calls below reuse the joined string
+        tech_stack = _normalize_tech_stack(tech_stack)
+        
+        if self.combine_estimates:
+            combined = await self._generate_combined_estimates(prd, num_developers, tech_stack)
+            if combined is not None:
+                return combined
+        
+        # Request both estimates concurrently
+        time_estimates, cost_estimates = await asyncio.gather(
+            self.generate_time_estimates(prd, num_developers, tech_stack),
+            self.generate_cost_estimates(prd, num_developers, tech_stack)
+        )
+        return time_estimates, cost_estimates
+    
+    async def _generate_combined_estimates(self, prd: str, num_developers: int, tech_stack: str) -> Optional[tuple]:
+        """Request both estimates in one call; None if the response was truncated or incomplete"""
+        message_content = self._estimation_content(prd, num_developers, tech_stack, COMBINED_ESTIMATION_PROMPT)
+        
+        try:
+            # Both breakdowns share one response, so it gets both estimate budgets
+            message = await self._create_message(
+                max_tokens=COMBINED_ESTIMATE_MAX_TOKENS,
+                system=ESTIMATION_SYSTEM,
+                tools=ESTIMATION_TOOLS,
+                tool_choice=_tool_choice(ESTIMATES_TOOL),
+                messages=[
+                    {
+                        "role": "user",
+                        "content": message_content
+                    }
+                ]
+            )
         except Exception as e:
             raise Exception(f"Claude API error: {str(e)}")
+        
+        try:
+            estimates = _tool_input(message, ESTIMATES_TOOL)
+            return estimates["time_estimates"], estimates["cost_estimates"]
+        except (ValueError, KeyError, TypeError):
+            return None
+
 
+# Global Claude service instance; shares one client and connection pool across callers
+claude_service = ClaudeService()
@@ -0,0 +1,16 @@
+"""
+Shared HTTP connection pools for the LLM provider SDK clients and backend calls
+"""
+import httpx
+
+_limits = httpx.Limits(max_connections=100, max_keepalive_connections=32)
+
+# One pool for the Azure OpenAI and Anthropic clients and backend posts, so TCP connections
+# and TLS sessions are reused across service instances and requests. HTTP/2 (negotiated via ALPN, falling back to HTTP/1.1) multiplexes concurrent requests to a
+# provider over a single connection
+async_http_client = httpx.AsyncClient(limits=_limits, http2=True)
+
+
+async def close_http_client():
+    """Close the shared connection pool (called on application shutdown)"""
+    await async_http_client.aclose()
@@ -2,11 +2,25 @@
 Azure OpenAI service for generating functional requirements
 """
 import os
-from openai import AzureOpenAI
+import asyncio
+import logging
+from typing import AsyncIterator
+from openai import AsyncAzureOpenAI, APIConnectionError, InternalServerError, RateLimitError
 from dotenv import load_dotenv
+from src.utils.prompts import render_functional_requirements_prompt
+from src.utils.cache import cached_response
+from src.utils.retry import with_retry_async, RATE_LIMIT_RETRIES
+from src.services.http_client import async_http_client
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Errors the SDK would itself retry (408/409 are matched by status code in with_retry_async);
+# calls wrapped in with_retry_async retry these instead
+RETRYABLE_ERRORS = (RateLimitError, InternalServerError, APIConnectionError)
+
+
 class AzureOpenAIService:
     def __init__(self):
         api_key = os.getenv("AZURE_OPENAI_API_KEY")
@@ -28,18 +42,46 @@ class AzureOpenAIService:
                 "Format: https://your-resource.openai.azure.com/"
             )
         
-        # Initialize Azure OpenAI client
-        self.client = AzureOpenAI(
+        # Async client: every call is made from a coroutine, so none block the event loop
+        self.client = AsyncAzureOpenAI(
             api_key=api_key,
             api_version=api_version,
-            azure_endpoint=azure_endpoint
+            azure_endpoint=azure_endpoint,
+            http_client=async_http_client
         )
         
         # Use the deployment name as the model name
         self.model = deployment_name
-        print(f"Initialized Azure OpenAI service with model: {self.model} (GPT-4o Mini)")
+        # Same client with SDK retries off, for calls already wrapped in with_retry_async
+        self.client_without_retries = self.client.with_options(max_retries=0)
+        # Caps in-flight requests from this process so bursts queue here instead of hitting 429s
+        self.limit = asyncio.Semaphore(int(os.getenv("AZURE_OPENAI_MAX_CONCURRENCY", "8")))
+        logger.info("Initialized Azure OpenAI service with model: %s", self.model)
+    
+    async def create_completion(self, sdk_retries: bool = True, **kwargs):
+        """
+        Create a chat completion on the async client, within the concurrency limit
+        
+        Args:
+            sdk_retries: Let the SDK retry failed requests; pass False when the caller
+                retries with with_retry_async, so the two don't multiply
+        """
+        client = self.client if sdk_retries else self.client_without_retries
+        async with self.limit:
+            return await client.chat.completions.create(model=self.model, **kwargs)
+    
+    async def stream_completion(self, **kwargs) -> AsyncIterator[str]:
+        """Stream the text of a chat completion, holding a concurrency slot until it ends"""
+        async with self.limit:
+            stream = await self.client.chat.completions.create(model=self.model, stream=True, **kwargs)
+            async for chunk in stream:
+                # Azure can send chunks without choices (e.g. content filter results)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
     
-    def generate_functional_requirements(
+    @cached_response("functional_requirements")
+    async def generate_functional_requirements(
         self,
         app_name: str = None,
         problem_solved: str = None,
@@ -80,59 +122,47 @@ class AzureOpenAIService:
         Returns:
             Functional requirements as markdown string
         """
-        from src.utils.prompts import FUNCTIONAL_REQUIREMENTS_PROMPT
-        
-        prompt = FUNCTIONAL_REQUIREMENTS_PROMPT.format(
-            app_name=app_name or "Not specified",
-            problem_solved=problem_solved or "Not specified",
-            core_features=core_features or "Not specified",
-            frontend_stack=frontend_stack or "Not specified",
-            backend_stack=backend_stack or "Not specified",
-            programming_language=programming_language or "Not specified",
-            database=database or "Not specified",
-            api_integrations=api_integrations or "None",
-            authentication=authentication or "Not specified",
-            roles_permissions=roles_permissions or "Not specified",
-            design_style=design_style or "Not specified",
-            theme=theme or "Not specified",
-            exclusions=exclusions or "None",
-            comparable_apps=comparable_apps or "None",
-            constraints=constraints or "None"
+        # Missing details render as "Not specified" / "None" (see prompts.py)
+        prompt = render_functional_requirements_prompt(
+            app_name=app_name,
+            problem_solved=problem_solved,
+            core_features=core_features,
+            frontend_stack=frontend_stack,
+            backend_stack=backend_stack,
+            programming_language=programming_language,
+            database=database,
+            api_integrations=api_integrations,
+            authentication=authentication,
+            roles_permissions=roles_permissions,
+            design_style=design_style,
+            theme=theme,
+            exclusions=exclusions,
+            comparable_apps=comparable_apps,
+            constraints=constraints
         )
         
-        # Add system instruction to the prompt
-        full_prompt = "You are an expert technical writer specializing in creating clear and concise functional requirements.\n\n" + prompt
-        
-        import time
-        max_retries = 3
-        retry_delay = 5
-        
-        for attempt in range(max_retries):
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
+        try:
+            # Quota windows on Azure are per-minute, so back off from 5 seconds
+            response = await with_retry_async(
+                lambda: self.create_completion(
+                    sdk_retries=False,
                     messages=[
                         {"role": "system", "content": "You are an expert technical writer specializing in creating clear and concise functional requirements."},
                         {"role": "user", "content": prompt}
                     ],
                     temperature=0.7,
                     max_tokens=2000
-                )
-                
-                return response.choices[0].message.content.strip()
-            except Exception as e:
-                error_str = str(e)
-                # Check if it's a quota/rate limit error
-                if "429" in error_str or "quota" in error_str.lower() or "rate limit" in error_str.lower():
-                    if attempt < max_retries - 1:
-                        print(f"Rate limit hit. Retrying in {retry_delay} seconds... (attempt {attempt + 1}/{max_retries})")
-                        time.sleep(retry_delay)
-                        retry_delay *= 2  # Exponential backoff
-                        continue
-                    else:
-                        raise Exception(f"Azure OpenAI rate limit exceeded after {max_retries} attempts: {str(e)}")
-                else:
-                    raise Exception(f"Azure OpenAI error: {str(e)}")
+                ),
+                retry_on=RETRYABLE_ERRORS,
+                base_delay=5
+            )
+        except RateLimitError as e:
+            raise Exception(f"Azure OpenAI rate limit exceeded after {RATE_LIMIT_RETRIES} attempts: {str(e)}")
+        except Exception as e:
+            raise Exception(f"Azure OpenAI error: {str(e)}")
         
-        raise Exception("Failed to generate content after retries")
+        return response.choices[0].message.content.strip()
+
 
+# Global Azure OpenAI service instance; shares one client and connection pool across callers
+azure_openai_service = AzureOpenAIService()
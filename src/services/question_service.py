@@ -1,245 +1,210 @@
 """
 Service to generate questions dynamically using OpenAI
 """
-from src.services.openai_service import AzureOpenAIService
-from typing import Optional, Dict, Any
+import logging
+import orjson
+from src.services.openai_service import azure_openai_service
+from src.utils.cache import cached_response
+from typing import Optional, Dict, Any, Tuple, Callable, Awaitable
 
+logger = logging.getLogger(__name__)
+
+# Order in which fields are collected; sessions track a pointer into it
+FIELD_ORDER = (
+    "appName",
+    "problemSolved",
+    "coreFeatures",
+    "num_developers",
+    "frontendStack",
+    "backendStack",
+    "programmingLanguage",
+    "database",
+    "apiIntegrations",
+    "authentication",
+    "rolesPermissions",
+    "designStyle",
+    "theme",
+    "exclusions",
+    "comparableApps",
+    "constraints",
+)
+
+# First 3 fields are required - must be filled (cannot be skipped)
+REQUIRED_FIELDS = frozenset({"appName", "problemSolved", "coreFeatures"})
+
+# Shared empty default for callers that have no skipped fields
+_NO_FIELDS: frozenset = frozenset()
+
+
+# Field descriptions for context
+FIELD_DESCRIPTIONS = {
+    "appName": "the name of the application",
+    "problemSolved": "what problem the application solves",
+    "coreFeatures": "the core features and functionalities",
+    "num_developers": "the number of developers working on the project",
+    "frontendStack": "frontend technologies and frameworks",
+    "backendStack": "backend technologies and frameworks",
+    "programmingLanguage": "the primary programming language",
+    "database": "the database system to be used",
+    "apiIntegrations": "external APIs and services to integrate",
+    "authentication": "user authentication methods",
+    "rolesPermissions": "user roles and permission system",
+    "designStyle": "the design style and aesthetic",
+    "theme": "theme preferences (dark mode, light mode, etc.)",
+    "exclusions": "features that should NOT be included",
+    "comparableApps": "similar existing applications for reference",
+    "constraints": "constraints and requirements (budget, timeline, compliance, etc.)",
+}
+
+# Static prompt text is built once at import and sent first (as the system message) so every
+# request shares an identical prefix that the provider can cache; per-turn data goes last
+QUESTION_SYSTEM_PROMPT = """Write a question collecting the given field of a user's software project.
+
+Rules: one sentence, max 15 words, direct and clear about the information needed, no examples or explanations.
+
+Reply with ONLY the question text."""
+
+TURN_SYSTEM_PROMPT = """You run an interview collecting information about a user's software project. Each turn, judge the user's answer to the current question and draft the question for the next field.
+
+An answer is satisfactory if it is relevant, specific and meaningful: not empty, vague, or a bare "yes", "no", "maybe" or "I don't know".
+
+Questions (follow-up or next): one sentence, max 15 words, direct, no examples or explanations.
+
+Reply with ONLY a JSON object:
+{"satisfactory": true or false, "follow_up": "question asking for the missing details if not satisfactory, else null", "next_question": "question for the next field, or null if none"}"""
 
 class QuestionService:
     """Generates questions for data collection using OpenAI and manages question flow"""
     
-    ALL_FIELDS = [
-        "appName",
-        "problemSolved",
-        "coreFeatures",
-        "num_developers",
-        "frontendStack",
-        "backendStack",
-        "programmingLanguage",
-        "database",
-        "apiIntegrations",
-        "authentication",
-        "rolesPermissions",
-        "designStyle",
-        "theme",
-        "exclusions",
-        "comparableApps",
-        "constraints",
-    ]
+    ALL_FIELDS = FIELD_ORDER
     
-    # Field descriptions for context
-    FIELD_DESCRIPTIONS = {
-        "appName": "the name of the application",
-        "problemSolved": "what problem the application solves",
-        "coreFeatures": "the core features and functionalities",
-        "num_developers": "the number of developers working on the project",
-        "frontendStack": "frontend technologies and frameworks",
-        "backendStack": "backend technologies and frameworks",
-        "programmingLanguage": "the primary programming language",
-        "database": "the database system to be used",
-        "apiIntegrations": "external APIs and services to integrate",
-        "authentication": "user authentication methods",
-        "rolesPermissions": "user roles and permission system",
-        "designStyle": "the design style and aesthetic",
-        "theme": "theme preferences (dark mode, light mode, etc.)",
-        "exclusions": "features that should NOT be included",
-        "comparableApps": "similar existing applications for reference",
-        "constraints": "constraints and requirements (budget, timeline, compliance, etc.)",
+    FIELD_DESCRIPTIONS = FIELD_DESCRIPTIONS
+    
+    # Base question templates as fallback (short and precise)
+    BASE_QUESTIONS = {
+        "appName": "What is your app name?",
+        "problemSolved": "What problem does it solve?",
+        "coreFeatures": "What are the core features?",
+        "num_developers": "How many developers?",
+        "frontendStack": "What frontend stack?",
+        "backendStack": "What backend stack?",
+        "programmingLanguage": "What programming language?",
+        "database": "What database?",
+        "apiIntegrations": "What API integrations?",
+        "authentication": "How will users authenticate?",
+        "rolesPermissions": "What roles and permissions?",
+        "designStyle": "What design style?",
+        "theme": "What theme preferences?",
+        "exclusions": "What should NOT be included?",
+        "comparableApps": "Any similar existing apps?",
+        "constraints": "Any constraints or requirements?",
     }
     
     def __init__(self):
-        self.llm = AzureOpenAIService()
+        self.llm = azure_openai_service
+        # Opening questions generated with no collected context, shared by all sessions
+        self._empty_ctx_cache: Dict[str, str] = {}
     
-    def get_next_field_to_ask(self, collected_data: Dict[str, Any], skipped_fields: set = None) -> Optional[str]:
+    def get_next_field_to_ask(self, collected_data: Dict[str, Any], skipped_fields: set = None, start_index: int = 0) -> Optional[str]:
         """
         Determine which field to ask about next based on what's already been collected
         
         Args:
             collected_data: Dictionary of already collected data
             skipped_fields: Set of fields that have been permanently skipped (never ask these again)
+            start_index: Index into FIELD_ORDER before which every field is known to be collected or skipped
             
         Returns:
             Field name to ask about next, or None if all non-skipped fields are collected
         """
-        skipped_fields = skipped_fields or set()
-        
-        # Find empty fields (excluding skipped ones)
-        empty_fields = [
-            field for field in self.ALL_FIELDS 
-            if field not in skipped_fields and (not collected_data.get(field) or collected_data.get(field) == "")
-        ]
+        skipped_fields = skipped_fields or _NO_FIELDS
         
-        if not empty_fields:
-            return None  # All non-skipped fields collected
-        
-        # Use OpenAI to determine the best next question based on context
-        return self._determine_best_next_field(empty_fields, collected_data)
+        # FIELD_ORDER already encodes the priority order, so this is a lookup rather than an LLM call
+        return next(
+            (
+                field for field in FIELD_ORDER[start_index:]
+                if field not in skipped_fields and not collected_data.get(field)
+            ),
+            None
+        )
     
-    def _determine_best_next_field(self, empty_fields: list, collected_data: Dict[str, Any]) -> str:
+    def peek_next_field(self, collected_data: Dict[str, Any], skipped_fields: set, answered_field: str, start_index: int = 0) -> Optional[str]:
         """
-        Use OpenAI to intelligently determine which field to ask about next
+        Field that will be asked once answered_field is filled
         
-        Args:
-            empty_fields: List of fields that haven't been collected yet
-            collected_data: Already collected data for context
-            
         Returns:
-            The best field to ask about next
+            The upcoming field, or None if there is none
         """
-        # Build context of what's been collected
-        collected_info = []
-        for field, value in collected_data.items():
-            if value:
-                field_desc = self.FIELD_DESCRIPTIONS.get(field, field)
-                collected_info.append(f"- {field_desc}: {value}")
-        
-        context_str = "\n".join(collected_info) if collected_info else "No information collected yet."
-        
-        # Build list of remaining fields with descriptions
-        remaining_fields = []
-        for field in empty_fields:
-            desc = self.FIELD_DESCRIPTIONS.get(field, field)
-            remaining_fields.append(f"{field}: {desc}")
-        
-        remaining_str = "\n".join(remaining_fields)
-        
-        prompt = f"""You are helping collect information about a software project. 
-
-Information already collected:
-{context_str}
-
-Remaining fields to collect:
-{remaining_str}
-
-Based on what's already been collected, determine which field should be asked about NEXT. Consider:
-1. Logical flow - what makes sense to ask next?
-2. Dependencies - some fields depend on others
-3. Priority - core information first, then details
-4. Natural conversation flow
-
-Respond with ONLY the field name (e.g., "appName" or "frontendStack"), nothing else."""
-
-        try:
-            result = self.llm.client.chat.completions.create(
-                model=self.llm.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that determines the best order to ask questions. Always respond with just the field name."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.5,
-                max_tokens=50
-            )
-            
-            suggested_field = result.choices[0].message.content.strip().strip('"').strip("'")
-            
-            # Validate the suggested field is in our list
-            if suggested_field in empty_fields:
-                return suggested_field
-            
-            # Fallback to first empty field if suggestion is invalid
-            return empty_fields[0]
-            
-        except Exception as e:
-            print(f"Error determining next field: {str(e)}")
-            # Fallback: return first empty field
-            return empty_fields[0] if empty_fields else None
+        return next(
+            (
+                field for field in FIELD_ORDER[start_index:]
+                if field != answered_field and field not in skipped_fields and not collected_data.get(field)
+            ),
+            None
+        )
     
-    def is_complete(self, collected_data: Dict[str, Any], skipped_fields: set = None) -> bool:
+    def is_complete(self, next_field_index: int) -> bool:
         """
         Check if all fields have been collected or skipped (only first 3 are required)
         
         Args:
-            collected_data: Dictionary of collected data
-            skipped_fields: Set of fields that have been permanently skipped
+            next_field_index: The session's pointer into FIELD_ORDER, which the session
+                manager advances past fields that are filled (or skipped, if optional)
             
         Returns:
             True if all fields are either collected or skipped, False otherwise
         """
-        skipped_fields = skipped_fields or set()
-        
-        # First 3 fields are required - must be filled (cannot be skipped)
-        required_fields = ["appName", "problemSolved", "coreFeatures"]
-        
-        for field in required_fields:
-            value = collected_data.get(field)
-            if not value or value == "":
-                return False  # Required fields must be filled
-        
-        # Check if all non-required fields are either filled or skipped
-        for field in self.ALL_FIELDS:
-            if field in required_fields:
-                continue  # Already checked above
-            value = collected_data.get(field)
-            if (not value or value == "") and field not in skipped_fields:
-                return False  # This field is not filled and not skipped
-        
-        return True  # All fields are either filled or skipped
+        return next_field_index >= len(FIELD_ORDER)
     
-    async def generate_question(self, field: str, context: dict = None) -> str:
+    async def generate_question(
+        self,
+        field: str,
+        context: dict = None,
+        on_delta: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> str:
         """
         Generate a question for a specific field
         
+        The completion is streamed; each text fragment is passed to on_delta as it
+        arrives so callers can show the question before it is finished. The
+        returned string is the final, cleaned-up question.
+        
         Args:
             field: The field name to generate a question for
             context: Optional context about what's already been collected
+            on_delta: Optional coroutine called with each streamed text fragment
             
         Returns:
             A question string
         """
-        # Base question templates as fallback (short and precise)
-        base_questions = {
-            "appName": "What is your app name?",
-            "problemSolved": "What problem does it solve?",
-            "coreFeatures": "What are the core features?",
-            "num_developers": "How many developers?",
-            "frontendStack": "What frontend stack?",
-            "backendStack": "What backend stack?",
-            "programmingLanguage": "What programming language?",
-            "database": "What database?",
-            "apiIntegrations": "What API integrations?",
-            "authentication": "How will users authenticate?",
-            "rolesPermissions": "What roles and permissions?",
-            "designStyle": "What design style?",
-            "theme": "What theme preferences?",
-            "exclusions": "What should NOT be included?",
-            "comparableApps": "Any similar existing apps?",
-            "constraints": "Any constraints or requirements?",
-        }
+        # With no context the question for a field is the same for every session
+        if not context and field in self._empty_ctx_cache:
+            return self._empty_ctx_cache[field]
         
         # Build context string
         context_str = ""
-        if context:
-            filled_fields = {k: v for k, v in context.items() if v is not None}
-            if filled_fields:
-                context_str = f"\n\nContext - Information already collected:\n"
-                for key, value in filled_fields.items():
-                    context_str += f"- {key}: {value}\n"
+        context_lines = [f"- {key}: {value}" for key, value in (context or {}).items() if value is not None]
+        if context_lines:
+            context_str = "\n\nContext - Information already collected:\n" + "\n".join(context_lines) + "\n"
         
-        prompt = f"""Generate a short, clear, and precise question to ask a user about their software project.
-
-Field to ask about: {field}
-{context_str}
-
-The question should:
-1. Be short and direct (one sentence, max 15 words)
-2. Be clear about what information is needed
-3. NO examples or additional explanations
-4. Be precise and to the point
-
-Generate ONLY the question text, no additional explanation or formatting."""
+        prompt = f"Field to ask about: {field}{context_str}"
 
         try:
-            result = self.llm.client.chat.completions.create(
-                model=self.llm.model,
+            parts = []
+            async for delta in self.llm.stream_completion(
                 messages=[
-                    {"role": "system", "content": "You are a helpful assistant that generates clear, friendly questions for collecting project information. Always respond with just the question text, no additional formatting."},
+                    {"role": "system", "content": QUESTION_SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.7,
-                max_tokens=150
-            )
+                max_tokens=40,
+                stop=["\n"]
+            ):
+                parts.append(delta)
+                if on_delta:
+                    await on_delta(delta)
             
-            question = result.choices[0].message.content.strip()
+            question = "".join(parts).strip()
             
             # Remove quotes if present
             if question.startswith('"') and question.endswith('"'):
@@ -247,62 +212,65 @@ Generate ONLY the question text, no additional explanation or formatting."""
             elif question.startswith("'") and question.endswith("'"):
                 question = question[1:-1]
             
+            if not question:
+                raise ValueError("empty completion")
+            
+            if not context:
+                self._empty_ctx_cache[field] = question
+            
             return question
             
         except Exception as e:
             # Fallback to base question if LLM fails
-            print(f"Error generating question for {field}: {str(e)}")
-            return base_questions.get(field, f"Please provide information about {field}.")
+            logger.warning("Error generating question for %s: %s", field, e)
+            return self.BASE_QUESTIONS.get(field, f"Please provide information about {field}.")
     
-    async def generate_follow_up_question(self, original_question: str, user_response: str, field: str) -> str:
+    @cached_response("turn_step")
+    async def turn_step(
+        self,
+        question: str,
+        response: str,
+        field: str,
+        context: dict,
+        next_field: Optional[str]
+    ) -> Tuple[bool, Optional[str], Optional[str]]:
         """
-        Generate a follow-up question when the initial response is unsatisfactory
+        Validate a response and draft the next question in a single LLM call
         
         Args:
-            original_question: The original question that was asked
-            user_response: The user's response that was deemed unsatisfactory
-            field: The field name
+            question: The question (or follow-up) the user answered
+            response: The user's response
+            field: The field being answered
+            context: Fields already collected
+            next_field: Field to draft the next question for, or None
             
         Returns:
-            A follow-up question string
+            (is_satisfactory, follow_up_question_if_needed, next_question_or_None)
         """
-        prompt = f"""The user was asked: "{original_question}"
-
-They responded: "{user_response}"
-
-This response was not satisfactory - it was too vague or incomplete.
-
-Generate a short, direct follow-up question that:
-1. Asks for more specific details
-2. Is concise (one sentence, max 15 words)
-3. NO examples or explanations
-4. Be precise and to the point
-
-Generate ONLY the follow-up question text, no additional explanation."""
-
-        try:
-            result = self.llm.client.chat.completions.create(
-                model=self.llm.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that generates friendly follow-up questions. Always respond with just the question text."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=150
-            )
-            
-            follow_up = result.choices[0].message.content.strip()
-            
-            # Remove quotes if present
-            if follow_up.startswith('"') and follow_up.endswith('"'):
-                follow_up = follow_up[1:-1]
-            elif follow_up.startswith("'") and follow_up.endswith("'"):
-                follow_up = follow_up[1:-1]
-            
-            return follow_up
-            
-        except Exception as e:
-            # Fallback follow-up
-            print(f"Error generating follow-up for {field}: {str(e)}")
-            return f"Please provide more details about {field}."
+        context_lines = [f"- {key}: {value}" for key, value in {**(context or {}), field: response}.items() if value]
+        prompt = f"""Question: {question}
+User's Response: {response}
+Field: {field}
+Next field to ask about: {next_field or "none"}
 
+Context - Information already collected:
+""" + "\n".join(context_lines)
+        
+        result = await self.llm.create_completion(
+            messages=[
+                {"role": "system", "content": TURN_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            response_format={"type": "json_object"},
+            temperature=0.3,
+            max_tokens=120
+        )
+        
+        turn = orjson.loads(result.choices[0].message.content)
+        is_satisfactory = bool(turn.get("satisfactory", False))
+        follow_up = turn.get("follow_up")
+        if not is_satisfactory and not follow_up:
+            follow_up = f"Please provide more details about {field}."
+        next_question = turn.get("next_question") if next_field else None
+        
+        return is_satisfactory, follow_up, next_question
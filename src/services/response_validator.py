@@ -1,77 +1,54 @@
 """
-Service to validate user responses using LLM
+Local checks on user responses; anything they can't decide is judged by the turn LLM call
 """
-from src.services.openai_service import AzureOpenAIService
-from typing import Optional, Tuple
+from src.services.question_service import FIELD_DESCRIPTIONS
+from typing import Callable, Dict
+
+# Replies that never answer a question, even when they look well-formed
+_NON_ANSWERS = frozenset({"yes", "no", "maybe", "idk", "dunno", "?", "i don't know", "not sure"})
+
+
+def _is_short_name(response: str) -> bool:
+    """Accept a technology or product name, e.g. React or PostgreSQL"""
+    text = response.strip()
+    return len(text) >= 2 and text.lower() not in _NON_ANSWERS
 
-class ResponseValidator:
-    """Validates user responses to questions"""
-    
-    def __init__(self):
-        self.llm = AzureOpenAIService()
-    
-    async def is_response_satisfactory(self, question: str, response: str, field: str) -> Tuple[bool, Optional[str]]:
-        """
-        Check if a response is satisfactory
-        
-        Returns:
-            (is_satisfactory, follow_up_question_if_needed)
-        """
-        validation_prompt = f"""You are validating a user's response to a question.
 
-Question: {question}
-User's Response: {response}
-Field: {field}
+def _is_positive_integer(response: str) -> bool:
+    """Accept a plain developer count, e.g. 3"""
+    text = response.strip()
+    return text.isdigit() and int(text) > 0
 
-Determine if the response is satisfactory. A satisfactory response should:
-1. Be relevant to the question
-2. Provide meaningful information (not just "yes", "no", "maybe", "I don't know", etc.)
-3. Be specific enough to be useful
-4. Not be empty or too vague
 
-Respond in JSON format:
-{{
-    "satisfactory": true/false,
-    "follow_up": "optional follow-up question if not satisfactory, or null if satisfactory"
-}}
+# Fields whose answers can be accepted by a local rule without an LLM call.
+# A response that fails its rule is still judged by QuestionService.turn_step.
+FIELD_QUICK_VALIDATORS: Dict[str, Callable[[str], bool]] = {
+    "frontendStack": _is_short_name,
+    "backendStack": _is_short_name,
+    "programmingLanguage": _is_short_name,
+    "database": _is_short_name,
+    "num_developers": _is_positive_integer,
+}
 
-Only respond with valid JSON, no additional text."""
 
-        try:
-            # Use the LLM to validate
-            result = self.llm.client.chat.completions.create(
-                model=self.llm.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that validates user responses. Always respond with valid JSON only."},
-                    {"role": "user", "content": validation_prompt}
-                ],
-                temperature=0.3,
-                max_tokens=200
-            )
-            
-            import json
-            response_text = result.choices[0].message.content.strip()
-            
-            # Remove markdown code blocks if present
-            if response_text.startswith("```json"):
-                response_text = response_text[7:]
-            elif response_text.startswith("```"):
-                response_text = response_text[3:]
-            
-            if response_text.endswith("```"):
-                response_text = response_text[:-3]
-            
-            response_text = response_text.strip()
-            
-            validation = json.loads(response_text)
-            
-            is_satisfactory = validation.get("satisfactory", False)
-            follow_up = validation.get("follow_up")
-            
-            return is_satisfactory, follow_up
-            
-        except Exception as e:
-            # If validation fails, assume response is satisfactory to avoid blocking
-            print(f"Validation error: {str(e)}")
-            return True, None
+def _is_non_answer(response: str) -> bool:
+    """Reject replies too short or too generic to answer any question"""
+    text = response.strip().lower()
+    return len(text) < 3 or text in _NON_ANSWERS
 
+
+class ResponseValidator:
+    """Validates user responses to questions"""
+    
+    def quick_accept(self, response: str, field: str) -> bool:
+        """Check if a response can be accepted by a local rule, without an LLM call"""
+        quick_validator = FIELD_QUICK_VALIDATORS.get(field)
+        return bool(quick_validator and quick_validator(response))
+    
+    def quick_reject(self, response: str, field: str) -> bool:
+        """Check if a response is a non-answer that can be rejected without an LLM call"""
+        return not self.quick_accept(response, field) and _is_non_answer(response)
+    
+    def non_answer_follow_up(self, field: str) -> str:
+        """Follow-up question asked after a locally rejected response"""
+        return f"Could you tell me more about {FIELD_DESCRIPTIONS.get(field, field)}?"
@@ -1,14 +1,35 @@
 """
 Session manager for WebSocket conversations
 """
+import os
+import time
+from collections import OrderedDict
 from typing import Dict, Optional, Any
 from datetime import datetime
 import uuid
+from dotenv import load_dotenv
+from src.services.question_service import FIELD_ORDER, REQUIRED_FIELDS
+
+load_dotenv()
 
 
 class SessionState:
     """Represents the state of a WebSocket session"""
     
+    # Fixed attribute layout: no per-instance __dict__ for the thousands of live sessions
+    __slots__ = (
+        "session_id",
+        "created_at",
+        "data",
+        "filled_context",
+        "current_question",
+        "follow_up_count",
+        "skipped_fields",
+        "next_field_index",
+        "completed",
+        "last_active",
+    )
+    
     def __init__(self, session_id: str):
         self.session_id = session_id
         self.created_at = datetime.now()
@@ -30,39 +51,97 @@ class SessionState:
             "constraints": None,
             "num_developers": None,
         }
+        # Non-None entries of data, kept up to date by SessionManager so callers don't rebuild it
+        self.filled_context: Dict[str, str] = {}
         self.current_question: Optional[str] = None
         self.follow_up_count: Dict[str, int] = {}  # Track follow-ups per field
         self.skipped_fields: set = set()  # Track permanently skipped fields
+        # Index into FIELD_ORDER of the first field that is still neither filled nor skipped
+        self.next_field_index = 0
         self.completed = False
+        # Monotonic time of the last lookup, used for idle expiry
+        self.last_active = time.monotonic()
+    
+    def _advance_next_field(self):
+        """Move the next-field pointer past fields that are filled or skipped"""
+        while self.next_field_index < len(FIELD_ORDER):
+            field = FIELD_ORDER[self.next_field_index]
+            if not self.data.get(field) and (field in REQUIRED_FIELDS or field not in self.skipped_fields):
+                break
+            self.next_field_index += 1
+    
+    def update_field(self, field: str, value: str):
+        """Update a field"""
+        self.data[field] = value
+        self.filled_context[field] = value
+        self._advance_next_field()
+    
+    def increment_follow_up(self, field: str):
+        """Increment follow-up count for a field"""
+        self.follow_up_count[field] = self.follow_up_count.get(field, 0) + 1
+    
+    def mark_field_skipped(self, field: str):
+        """Permanently mark a field as skipped"""
+        self.skipped_fields.add(field)
+        # Set a placeholder value so it's not considered empty
+        self.data[field] = ""
+        # Skipped fields carry no information for question context
+        self.filled_context.pop(field, None)
+        self._advance_next_field()
 
 
 class SessionManager:
-    """Manages WebSocket sessions"""
+    """Manages WebSocket sessions, bounded by count and idle time"""
+    
+    def __init__(self, max_sessions: int = 10_000, ttl_seconds: float = 3600):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        # Ordered least recently used first, so expired sessions sit at the front
+        self.sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+    
+    def _evict(self):
+        """Drop sessions idle longer than the TTL, then the oldest ones over capacity"""
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self.sessions:
+            oldest = next(iter(self.sessions.values()))
+            if oldest.last_active >= cutoff:
+                break
+            self.sessions.popitem(last=False)
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
     
-    def __init__(self):
-        self.sessions: Dict[str, SessionState] = {}
+    def touch(self, session_id: str):
+        """Mark a session as recently used, refreshing its TTL"""
+        session = self.sessions.get(session_id)
+        if session:
+            session.last_active = time.monotonic()
+            self.sessions.move_to_end(session_id)
     
     def create_session(self) -> str:
         """Create a new session and return session ID"""
         session_id = str(uuid.uuid4())
         self.sessions[session_id] = SessionState(session_id)
+        self._evict()
         return session_id
     
     def get_session(self, session_id: str) -> Optional[SessionState]:
-        """Get session by ID"""
+        """Get session by ID, or None if it is unknown or has expired"""
+        self._evict()
+        self.touch(session_id)
         return self.sessions.get(session_id)
     
     def update_field(self, session_id: str, field: str, value: str):
         """Update a field in the session"""
-        if session_id in self.sessions:
-            self.sessions[session_id].data[field] = value
+        session = self.sessions.get(session_id)
+        if session:
+            self.touch(session_id)
+            session.update_field(field, value)
     
     def increment_follow_up(self, session_id: str, field: str):
         """Increment follow-up count for a field"""
-        if session_id in self.sessions:
-            if field not in self.sessions[session_id].follow_up_count:
-                self.sessions[session_id].follow_up_count[field] = 0
-            self.sessions[session_id].follow_up_count[field] += 1
+        session = self.sessions.get(session_id)
+        if session:
+            session.increment_follow_up(field)
     
     def get_follow_up_count(self, session_id: str, field: str) -> int:
         """Get follow-up count for a field"""
@@ -72,10 +151,9 @@ class SessionManager:
     
     def mark_field_skipped(self, session_id: str, field: str):
         """Permanently mark a field as skipped"""
-        if session_id in self.sessions:
-            self.sessions[session_id].skipped_fields.add(field)
-            # Set a placeholder value so it's not considered empty
-            self.sessions[session_id].data[field] = ""
+        session = self.sessions.get(session_id)
+        if session:
+            session.mark_field_skipped(field)
     
     def is_field_skipped(self, session_id: str, field: str) -> bool:
         """Check if a field has been permanently skipped"""
@@ -83,70 +161,13 @@ class SessionManager:
             return field in self.sessions[session_id].skipped_fields
         return False
     
-    def get_next_empty_field(self, session_id: str) -> Optional[str]:
-        """Get the next empty field that needs to be filled"""
-        if session_id not in self.sessions:
-            return None
-        
-        session = self.sessions[session_id]
-        
-        # Priority order for questions - ALL fields must be answered
-        priority_fields = [
-            "appName",
-            "problemSolved",
-            "coreFeatures",
-            "num_developers",
-            "frontendStack",
-            "backendStack",
-            "programmingLanguage",
-            "database",
-            "apiIntegrations",
-            "authentication",
-            "rolesPermissions",
-            "designStyle",
-            "theme",
-            "exclusions",
-            "comparableApps",
-            "constraints",
-        ]
-        
-        for field in priority_fields:
-            if session.data[field] is None:
-                # Only skip if we've done one follow-up AND still couldn't get a response
-                # But we'll still try to ask again if it's the only remaining field
-                follow_up_count = self.get_follow_up_count(session_id, field)
-                if follow_up_count >= 1:
-                    # Check if there are other empty fields first
-                    other_empty = [f for f in priority_fields if f != field and session.data[f] is None]
-                    if other_empty:
-                        continue  # Skip this one, try others first
-                    # This is the last empty field, try one more time
-                    if follow_up_count >= 2:
-                        continue  # Already tried twice, skip
-                return field
-        
-        return None
-    
     def is_complete(self, session_id: str) -> bool:
         """Check if all required fields are filled (only first 3 are required)"""
-        if session_id not in self.sessions:
+        session = self.sessions.get(session_id)
+        if not session:
             return False
         
-        session = self.sessions[session_id]
-        
-        # Only first 3 fields are required
-        required_fields = [
-            "appName",
-            "problemSolved",
-            "coreFeatures",
-        ]
-        
-        for field in required_fields:
-            value = session.data.get(field)
-            if not value or value == "":
-                return False
-        
-        return True
+        return all(session.data.get(field) for field in REQUIRED_FIELDS)
     
     def get_data(self, session_id: str) -> Dict[str, Any]:
         """Get all session data as a dict"""
@@ -158,10 +179,12 @@ class SessionManager:
     
     def delete_session(self, session_id: str):
         """Delete a session"""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+        self.sessions.pop(session_id, None)
 
 
 # Global session manager instance
-session_manager = SessionManager()
+session_manager = SessionManager(
+    max_sessions=int(os.getenv("SESSION_MAX_COUNT", "10000")),
+    ttl_seconds=float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+)
 
@@ -2,30 +2,42 @@
 Service to execute the complete workflow: functional requirements -> TRD -> time/cost estimates
 """
 import os
-import json
+import gzip
 import asyncio
+import logging
 import httpx
-from typing import Dict, Any, Optional
-from src.services.openai_service import AzureOpenAIService
-from src.services.claude_service import ClaudeService
+import orjson
+from typing import Dict, Any
+from src.services.openai_service import azure_openai_service
+from src.services.claude_service import claude_service, format_tech_stack, TECH_STACK_FIELDS
+from src.services.http_client import async_http_client
+
+logger = logging.getLogger(__name__)
+
+# Attempts made to deliver results to the backend before giving up
+BACKEND_SEND_ATTEMPTS = 5
 
 
 class WorkflowService:
     """Executes the complete workflow and sends results to backend"""
     
     def __init__(self):
-        self.azure_openai_service = AzureOpenAIService()
-        self.claude_service = ClaudeService()
+        self.azure_openai_service = azure_openai_service
+        self.claude_service = claude_service
         backend_base_url = os.getenv("BACKEND_ENDPOINT_URL", "")
         # Append /api/v1/projects endpoint to base URL
         self.backend_endpoint = f"{backend_base_url.rstrip('/')}/api/v1/projects" if backend_base_url else ""
+        # Gzip the payload when the backend accepts Content-Encoding: gzip (opt-in)
+        self.compress_backend_payload = os.getenv("BACKEND_GZIP", "false").lower() == "true"
+        # Backend deliveries still in flight; holds references so the tasks aren't garbage collected
+        self._pending_sends: set = set()
     
     async def execute_workflow(self, collected_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Execute the complete workflow:
         1. Generate functional requirements
         2. Generate TRD (PRD)
-        3. Generate time and cost estimates in parallel
+        3. Generate time and cost estimates together
         4. Send to backend endpoint
         
         Args:
@@ -36,9 +48,8 @@ class WorkflowService:
         """
         try:
             # Step 1: Generate functional requirements (sequential - must complete before step 2)
-            print("🔄 Step 1: Generating functional requirements...")
-            functional_requirements = await asyncio.to_thread(
-                self.azure_openai_service.generate_functional_requirements,
+            logger.info("🔄 Step 1: Generating functional requirements...")
+            functional_requirements = await self.azure_openai_service.generate_functional_requirements(
                 app_name=collected_data.get("appName"),
                 problem_solved=collected_data.get("problemSolved"),
                 core_features=collected_data.get("coreFeatures"),
@@ -55,27 +66,15 @@ class WorkflowService:
                 comparable_apps=collected_data.get("comparableApps"),
                 constraints=collected_data.get("constraints")
             )
-            print(f"✅ Functional requirements generated ({len(functional_requirements)} chars)")
+            logger.info("✅ Functional requirements generated (%d chars)", len(functional_requirements))
             
             # Step 2: Generate TRD (PRD) from functional requirements (sequential - after step 1 completes)
-            print("🔄 Step 2: Generating TRD/PRD...")
-            trd = await asyncio.to_thread(
-                self.claude_service.generate_prd,
-                functional_requirements
-            )
-            print(f"✅ TRD/PRD generated ({len(trd)} chars)")
-            
-            # Combine tech stack for estimates
-            tech_stack_list = []
-            if collected_data.get("frontendStack"):
-                tech_stack_list.append(collected_data.get("frontendStack"))
-            if collected_data.get("backendStack"):
-                tech_stack_list.append(collected_data.get("backendStack"))
-            if collected_data.get("programmingLanguage"):
-                tech_stack_list.append(collected_data.get("programmingLanguage"))
-            if collected_data.get("database"):
-                tech_stack_list.append(collected_data.get("database"))
-            tech_stack_str = ", ".join(tech_stack_list) if tech_stack_list else "Not specified"
+            logger.info("🔄 Step 2: Generating TRD/PRD...")
+            trd = await self.claude_service.generate_prd(functional_requirements)
+            logger.info("✅ TRD/PRD generated (%d chars)", len(trd))
+            
+            # Combine tech stack for estimates (one lookup per field)
+            tech_stack_str = format_tech_stack(map(collected_data.get, TECH_STACK_FIELDS))
             
             num_developers = collected_data.get("num_developers")
             if num_developers:
@@ -84,30 +83,17 @@ class WorkflowService:
                 except (ValueError, TypeError):
                     num_developers = None
             
-            # Step 3 & 4: Generate time and cost estimates in parallel (only these two run together)
-            print("🔄 Step 3 & 4: Generating time and cost estimates in parallel...")
-            time_estimates, cost_estimates = await asyncio.gather(
-                asyncio.to_thread(
-                    self.claude_service.generate_time_estimates,
-                    trd,
-                    num_developers,
-                    tech_stack_str
-                ),
-                asyncio.to_thread(
-                    self.claude_service.generate_cost_estimates,
-                    trd,
-                    num_developers,
-                    tech_stack_str
-                )
+            # Step 3 & 4: Generate time and cost estimates (one Claude call where the model allows)
+            logger.info("🔄 Step 3 & 4: Generating time and cost estimates...")
+            time_estimates, cost_estimates = await self.claude_service.generate_estimates(
+                trd,
+                num_developers,
+                tech_stack_str
             )
             
-            # Step 5: Send to backend endpoint
-            print("🔄 Step 5: Sending to backend endpoint...")
-            backend_status = await self._send_to_backend(trd, time_estimates, cost_estimates)
-            if backend_status.get("sent"):
-                print(f"✅ Successfully sent to backend (Status: {backend_status.get('status_code')})")
-            else:
-                print(f"⚠️  Backend send failed: {backend_status.get('message')}")
+            # Step 5: Send to backend endpoint in the background so the user isn't kept waiting on it
+            logger.info("🔄 Step 5: Sending to backend endpoint...")
+            backend_status = self._schedule_backend_send(trd, time_estimates, cost_estimates)
             
             return {
                 "success": True,
@@ -127,6 +113,56 @@ class WorkflowService:
                 "backend_status": None
             }
     
+    def _schedule_backend_send(self, trd: str, time_estimate: Dict[str, Any], cost_estimate: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Start delivering results to the backend without waiting for it
+        
+        Returns:
+            Dictionary with backend status; "pending" is True while delivery is in progress
+        """
+        if not self.backend_endpoint:
+            return {
+                "sent": False,
+                "message": "Backend endpoint URL not configured (BACKEND_ENDPOINT_URL)"
+            }
+        
+        task = asyncio.create_task(self._deliver_to_backend(trd, time_estimate, cost_estimate))
+        self._pending_sends.add(task)
+        task.add_done_callback(self._pending_sends.discard)
+        return {
+            "sent": False,
+            "pending": True,
+            "message": "Sending to backend in the background"
+        }
+    
+    async def _deliver_to_backend(self, trd: str, time_estimate: Dict[str, Any], cost_estimate: Dict[str, Any]):
+        """
+        Send results to the backend, retrying with exponential backoff
+        
+        Only connection failures and 5xx responses are retried. The POST creates a
+        project and isn't idempotent, so a read timeout (which the backend may
+        already have processed) is not retried, to avoid creating duplicates.
+        """
+        for attempt in range(BACKEND_SEND_ATTEMPTS):
+            backend_status = await self._send_to_backend(trd, time_estimate, cost_estimate)
+            if backend_status.get("sent"):
+                logger.info("✅ Successfully sent to backend (Status: %s)", backend_status.get("status_code"))
+                return
+            
+            if not backend_status.get("retryable") or attempt == BACKEND_SEND_ATTEMPTS - 1:
+                break
+            
+            delay = min(60, 2 ** attempt)
+            logger.warning("⚠️  Backend send failed, retrying in %ds: %s", delay, backend_status.get("message"))
+            await asyncio.sleep(delay)
+        
+        logger.warning("⚠️  Backend send failed: %s", backend_status.get("message"))
+    
+    async def wait_for_pending_sends(self, timeout: float = 30.0):
+        """Give in-flight backend deliveries a chance to finish (called on application shutdown)"""
+        if self._pending_sends:
+            await asyncio.wait(self._pending_sends, timeout=timeout)
+    
     async def _send_to_backend(self, trd: str, time_estimate: Dict[str, Any], cost_estimate: Dict[str, Any]) -> Dict[str, Any]:
         """
         Send TRD, time estimate, and cost estimate to backend endpoint
@@ -137,7 +173,8 @@ class WorkflowService:
             cost_estimate: Cost estimates dictionary
             
         Returns:
-            Dictionary with backend response status
+            Dictionary with backend response status; "retryable" is True when the
+            request certainly wasn't processed or the backend failed with a 5xx
         """
         if not self.backend_endpoint:
             return {
@@ -152,31 +189,48 @@ class WorkflowService:
                 "estimated_cost": cost_estimate
             }
             
-            print(f"   📤 Sending to: {self.backend_endpoint}")
-            print(f"   📦 Payload size: trd={len(trd)} chars, estimated_time={len(json.dumps(time_estimate))} bytes, estimated_cost={len(json.dumps(cost_estimate))} bytes")
-            
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    self.backend_endpoint,
-                    json=payload,
-                    headers={"Content-Type": "application/json"}
-                )
-                response.raise_for_status()
-                
-                return {
-                    "sent": True,
-                    "status_code": response.status_code,
-                    "message": "Successfully sent to backend"
-                }
-                
+            # Serialize once; the size log reuses the encoded body
+            body = orjson.dumps(payload)
+            headers = {"Content-Type": "application/json"}
+            if self.compress_backend_payload:
+                body = gzip.compress(body, compresslevel=6)
+                headers["Content-Encoding"] = "gzip"
+            
+            logger.info("   📤 Sending to: %s", self.backend_endpoint)
+            logger.info("   📦 Payload size: %d bytes%s", len(body), " (gzip)" if self.compress_backend_payload else "")
+            
+            # Reuse the shared pool so repeated sends skip the TCP/TLS handshake
+            response = await async_http_client.post(
+                self.backend_endpoint,
+                content=body,
+                headers=headers,
+                timeout=30.0
+            )
+            response.raise_for_status()
+            
+            return {
+                "sent": True,
+                "status_code": response.status_code,
+                "message": "Successfully sent to backend"
+            }
+            
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            # The request never reached the backend, so it is safe to send again
+            return {
+                "sent": False,
+                "retryable": True,
+                "message": f"Could not connect to backend: {str(e)}"
+            }
         except httpx.TimeoutException:
             return {
                 "sent": False,
+                "retryable": False,
                 "message": "Backend request timed out"
             }
         except httpx.HTTPStatusError as e:
             return {
                 "sent": False,
+                "retryable": e.response.status_code >= 500,
                 "status_code": e.response.status_code,
                 "message": f"Backend returned error: {e.response.text}"
             }
@@ -186,3 +240,6 @@ class WorkflowService:
                 "message": f"Error sending to backend: {str(e)}"
             }
 
+
+# Global workflow service instance
+workflow_service = WorkflowService()
@@ -0,0 +1,111 @@
+"""
+In-process response cache for LLM service calls
+"""
+import os
+import hashlib
+import functools
+import inspect
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Tuple
+import orjson
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def make_key(*parts: Any) -> str:
+    """
+    Build a stable cache key from arbitrary call inputs
+
+    Inputs are serialized to canonical JSON (sorted keys, surrounding whitespace
+    stripped from strings) so equivalent requests map to the same key.
+    """
+    def normalize(value: Any) -> Any:
+        if isinstance(value, str):
+            return value.strip()
+        if isinstance(value, dict):
+            return {str(k): normalize(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        return value
+
+    canonical = orjson.dumps(normalize(parts), default=str, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(canonical, digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of LLM responses"""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """Return (hit, value) for a key, refreshing its recency on a hit"""
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            self._entries.move_to_end(key)
+            return True, self._entries[key]
+
+    def set(self, key: str, value: Any):
+        """Store a value, evicting the least recently used entry when full"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all cached responses"""
+        with self._lock:
+            self._entries.clear()
+
+
+# Global response cache instance (LLM_CACHE_SIZE=0 disables caching)
+response_cache = ResponseCache(maxsize=int(os.getenv("LLM_CACHE_SIZE", "256")))
+
+
+def cached_response(namespace: str) -> Callable:
+    """
+    Cache the result of an LLM service method
+
+    The key combines the namespace, the service's model and the call arguments,
+    so a hit skips the network round-trip entirely. Exceptions are never cached.
+    Works for both sync and async methods.
+
+    Args:
+        namespace: Name identifying the kind of response being cached
+    """
+    def decorator(func: Callable) -> Callable:
+        def key_for(self, args, kwargs) -> str:
+            return make_key(namespace, getattr(self, "model", None), args, kwargs)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                key = key_for(self, args, kwargs)
+                hit, value = response_cache.get(key)
+                if hit:
+                    return value
+                value = await func(self, *args, **kwargs)
+                response_cache.set(key, value)
+                return value
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            key = key_for(self, args, kwargs)
+            hit, value = response_cache.get(key)
+            if hit:
+                return value
+            value = func(self, *args, **kwargs)
+            response_cache.set(key, value)
+            return value
+        return wrapper
+
+    return decorator
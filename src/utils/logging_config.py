@@ -0,0 +1,47 @@
+"""
+Logging configuration: records are queued on the calling thread and written by a background listener
+"""
+import os
+import queue
+import logging
+import logging.handlers
+from typing import Optional
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging():
+    """
+    Route all log records through a QueueHandler so stream I/O happens on a
+    worker thread instead of the event loop.
+    
+    The message itself is still formatted on the calling thread: QueueHandler.prepare
+    merges the args into record.msg before enqueueing, so mutable arguments are
+    captured as they were when logged. The listener thread only adds the timestamp
+    and level prefix and writes the line.
+
+    The level comes from the LOG_LEVEL environment variable (default INFO), so
+    debug output costs nothing unless LOG_LEVEL=DEBUG.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    root = logging.getLogger()
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Flush queued records and stop the background listener"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
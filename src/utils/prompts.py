@@ -1,119 +1,122 @@
 """
 Prompt templates for AI workflow generation
 """
+from string import Formatter
+from typing import Callable, Dict, Optional
+
+
+def compile_template(template: str, defaults: Optional[Dict[str, str]] = None) -> Callable[..., str]:
+    """
+    Parse a str.format template once and return a renderer for it
+    
+    The renderer joins the pre-split literal text and field values, so the
+    template is not re-parsed on every call. Only plain {name} fields are
+    supported (no format specs or conversions).
+    
+    Args:
+        template: Template string using str.format field syntax
+        defaults: Text rendered for fields that are missing, None or empty;
+            fields without a default render as ""
+        
+    Returns:
+        Callable taking the template fields as keyword arguments
+    """
+    defaults = defaults or {}
+    parts = []
+    for literal, field, spec, conversion in Formatter().parse(template):
+        if spec or conversion:
+            raise ValueError(f"Unsupported template field: {field}")
+        parts.append((literal, field, defaults.get(field, "")))
+    
+    def render(**fields) -> str:
+        out = []
+        for literal, field, default in parts:
+            out.append(literal)
+            if field is not None:
+                value = fields.get(field)
+                out.append(default if value is None or value == "" else str(value))
+        return "".join(out)
+    
+    return render
 
-FUNCTIONAL_REQUIREMENTS_PROMPT = """I would like to create concise functional requirements for the following application:
 
+FUNCTIONAL_REQUIREMENTS_PROMPT = """I would like to create concise functional requirements for the following application:
 **App Name:** {app_name}
-
 **Problem Solved:** {problem_solved}
-
 **Core Features:**
 {core_features}
-
 **Frontend Stack:** {frontend_stack}
-
 **Backend Stack:** {backend_stack}
-
 **Programming Language:** {programming_language}
-
 **Database:** {database}
-
 **API Integrations:** {api_integrations}
-
 **Authentication:** {authentication}
-
 **Roles & Permissions:** {roles_permissions}
-
 **Design Style:** {design_style}
-
 **Theme:** {theme}
-
 **Exclusions (Things NOT to Build):** {exclusions}
-
 **Comparable/Existing Apps:** {comparable_apps}
-
 **Constraints:** {constraints}
-
 Please research the comparable apps if provided and consider their features and functionality when creating the requirements.
-
 Output as markdown code.
-
 Go through these in detail and ensure there's nothing in there that you don't want.
-
 Keep it as precise as possible."""
 
-PRD_GENERATION_PROMPT = """You are an expert technical product manager specializing in feature development and creating comprehensive product requirements documents (PRDs). Your task is to generate a detailed and well-structured PRD based on the following functional requirements:
-
-<functional_requirements>
-{functional_requirements}
-</functional_requirements>
-
-Follow these steps to create the PRD:
-
-1. Begin with a brief overview explaining the project and the purpose of the document.
-
-2. Use sentence case for all headings except for the title of the document, which should be in title case.
-
-3. Organize your PRD into the following sections:
-
+render_functional_requirements_prompt = compile_template(
+    FUNCTIONAL_REQUIREMENTS_PROMPT,
+    defaults={
+        "app_name": "Not specified",
+        "problem_solved": "Not specified",
+        "core_features": "Not specified",
+        "frontend_stack": "Not specified",
+        "backend_stack": "Not specified",
+        "programming_language": "Not specified",
+        "database": "Not specified",
+        "api_integrations": "None",
+        "authentication": "Not specified",
+        "roles_permissions": "Not specified",
+        "design_style": "Not specified",
+        "theme": "Not specified",
+        "exclusions": "None",
+        "comparable_apps": "None",
+        "constraints": "None",
+    }
+)
+
+PRD_SYSTEM_PROMPT = """You are an expert technical product manager. Write a detailed, well-structured product requirements document (PRD) from the functional requirements the user provides.
+1. Open with a brief overview of the project and the document's purpose.
+2. Title in title case; all other headings in sentence case.
+3. Sections:
    a. Introduction
-
    b. Product Overview
-
    c. Goals and Objectives
-
    d. Target Audience
-
    e. Features and Requirements
-
    f. User Stories and Acceptance Criteria
-
    g. Technical Requirements / Stack
-
    h. Design and User Interface
+4. Fill every section with specific, relevant detail and metrics from the functional requirements.
+5. User stories:
+   - Cover ALL primary, alternative and edge-case scenarios
+   - Give each a unique ID (e.g., ST-101)
+   - Include one for secure access/authentication if users must be identified
+   - Include one for database modelling if a database is required
+   - Make each testable, with acceptance criteria
+6. Formatting: numbered sections and subsections, bullet points and tables where they help readability.
+7. Check for gaps, contradictions and ambiguities before finishing.
+Put the final PRD within <PRD> tags, starting with its title."""
+
+PRD_GENERATION_PROMPT = """<functional_requirements>
+{functional_requirements}
+</functional_requirements>"""
 
-4. For each section, provide detailed and relevant information based on the functional requirements. Ensure that you:
-
-   - Use clear and concise language
-
-   - Provide specific details and metrics where required
-
-   - Maintain consistency throughout the document
-
-   - Address all points mentioned in each section
-
-5. When creating user stories and acceptance criteria:
-
-   - List ALL necessary user stories including primary, alternative, and edge-case scenarios
-
-   - Assign a unique requirement ID (e.g., ST-101) to each user story for direct traceability
-
-   - Include at least one user story specifically for secure access or authentication if the application requires user identification
-
-   - Include at least one user story specifically for Database modelling if the application requires a database
-
-   - Ensure no potential user interaction is omitted
-
-   - Make sure each user story is testable
-
-6. Format your PRD professionally:
-
-   - Use consistent styles
-
-   - Include numbered sections and subsections
-
-   - Use bullet points and tables where appropriate to improve readability
-
-   - Ensure proper spacing and alignment throughout the document
-
-7. Review your PRD to ensure all aspects of the project are covered comprehensively and that there are no contradictions or ambiguities.
-
-Present your final PRD within <PRD> tags. Begin with the title of the document in title case, followed by each section with its corresponding content. Use appropriate subheadings within each section as needed.
+# Split once at import so rendering the PRD prompt is a plain concatenation instead of str.format
+PRD_PROMPT_PREFIX, PRD_PROMPT_SUFFIX = PRD_GENERATION_PROMPT.split("{functional_requirements}", 1)
 
-Remember to tailor the content to the specific project described in the functional requirements, providing detailed and relevant information for each section based on the given context."""
+# Shared by the time, cost and combined estimate calls
+ESTIMATION_SYSTEM_PROMPT = "You are an expert project manager and technical lead."
 
-TIME_ESTIMATION_PROMPT = """You are an expert project manager and technical lead. Based on the following Product Requirements Document (PRD), generate a detailed time estimation breakdown.
+ESTIMATION_CONTEXT_PROMPT = """Here is the Product Requirements Document (PRD) and project metadata to base your estimates on.
 
 <PRD>
 {prd}
@@ -122,134 +125,128 @@ TIME_ESTIMATION_PROMPT = """You are an expert project manager and technical lead
 <project_metadata>
 Number of Developers: {num_developers}
 Tech Stack: {tech_stack}
-</project_metadata>
-
-Generate a JSON response with the following structure:
-{{
-  "frontend": {{
-    "tasks": [
-      {{
-        "task_name": "string",
-        "description": "string",
-        "estimated_hours": number,
-        "complexity": "low|medium|high"
-      }}
-    ],
-    "total_hours": number
-  }},
-  "backend": {{
-    "tasks": [
-      {{
-        "task_name": "string",
-        "description": "string",
-        "estimated_hours": number,
-        "complexity": "low|medium|high"
-      }}
-    ],
-    "total_hours": number
-  }},
-  "ai_tasks": {{
-    "tasks": [
-      {{
-        "task_name": "string",
-        "description": "string",
-        "estimated_hours": number,
-        "complexity": "low|medium|high"
-      }}
-    ],
-    "total_hours": number
-  }},
-  "total_project_hours": number,
-  "estimated_weeks": number
-}}
-
-Break down tasks by technology stack components. Be realistic and consider:
+</project_metadata>"""
+
+render_estimation_context_prompt = compile_template(
+    ESTIMATION_CONTEXT_PROMPT,
+    defaults={"num_developers": "Not specified", "tech_stack": "Not specified"}
+)
+
+# Estimates are returned through forced tool use, so the API hands back the tool input as an
+# already-parsed object matching these JSON schemas instead of free text to be parsed
+_NUMBER = {"type": "number"}
+_STRING = {"type": "string"}
+
+
+def _object(properties: dict) -> dict:
+    """JSON schema for an object requiring all of the given properties"""
+    return {"type": "object", "properties": properties, "required": list(properties)}
+
+
+_TIME_TASK = _object({
+    "task_name": _STRING,
+    "description": _STRING,
+    "estimated_hours": _NUMBER,
+    "complexity": {"type": "string", "enum": ["low", "medium", "high"]},
+})
+
+_COST_TASK = _object({
+    "task_name": _STRING,
+    "description": _STRING,
+    "estimated_hours": _NUMBER,
+    "hourly_rate": _NUMBER,
+    "total_cost": _NUMBER,
+    "complexity": {"type": "string", "enum": ["low", "medium", "high"]},
+})
+
+_TIME_SECTION = _object({"tasks": {"type": "array", "items": _TIME_TASK}, "total_hours": _NUMBER})
+_COST_SECTION = _object({"tasks": {"type": "array", "items": _COST_TASK}, "total_hours": _NUMBER, "total_cost": _NUMBER})
+
+TIME_ESTIMATES_SCHEMA = _object({
+    "frontend": _TIME_SECTION,
+    "backend": _TIME_SECTION,
+    "ai_tasks": _TIME_SECTION,
+    "total_project_hours": _NUMBER,
+    "estimated_weeks": _NUMBER,
+})
+
+COST_ESTIMATES_SCHEMA = _object({
+    "frontend": _COST_SECTION,
+    "backend": _COST_SECTION,
+    "ai_tasks": _COST_SECTION,
+    "infrastructure": _object({
+        "items": {"type": "array", "items": _object({
+            "item_name": _STRING,
+            "description": _STRING,
+            "monthly_cost": _NUMBER,
+            "estimated_months": _NUMBER,
+            "total_cost": _NUMBER,
+        })},
+        "total_cost": _NUMBER,
+    }),
+    "total_project_cost": _NUMBER,
+    "estimated_weeks": _NUMBER,
+})
+
+TIME_ESTIMATES_TOOL = {
+    "name": "record_time_estimates",
+    "description": "Record the time estimation breakdown for the project.",
+    "input_schema": TIME_ESTIMATES_SCHEMA,
+}
+
+COST_ESTIMATES_TOOL = {
+    "name": "record_cost_estimates",
+    "description": "Record the cost estimation breakdown for the project.",
+    "input_schema": COST_ESTIMATES_SCHEMA,
+}
+
+ESTIMATES_TOOL = {
+    "name": "record_estimates",
+    "description": "Record the time and cost estimation breakdowns for the project.",
+    "input_schema": _object({
+        "time_estimates": TIME_ESTIMATES_SCHEMA,
+        "cost_estimates": COST_ESTIMATES_SCHEMA,
+    }),
+}
+
+# Every estimate call sends all three tools and forces one with tool_choice, so the tool
+# definitions (roughly 2.5K tokens) form one stable prefix that can be prompt-cached
+ESTIMATION_TOOLS = [TIME_ESTIMATES_TOOL, COST_ESTIMATES_TOOL, ESTIMATES_TOOL]
+
+TIME_ESTIMATION_GUIDELINES = """Break down tasks by technology stack components. Be realistic and consider:
 - Setup and configuration time
 - Development time per feature
 - Testing and debugging
 - Code review and refactoring
-- Documentation
-
-Return ONLY valid JSON, no markdown formatting or additional text."""
-
-COST_ESTIMATION_PROMPT = """You are an expert project manager and technical lead. Based on the following Product Requirements Document (PRD), generate a detailed cost estimation breakdown.
-
-<PRD>
-{prd}
-</PRD>
+- Documentation"""
 
-<project_metadata>
-Number of Developers: {num_developers}
-Tech Stack: {tech_stack}
-</project_metadata>
-
-Generate a JSON response with the following structure:
-{{
-  "frontend": {{
-    "tasks": [
-      {{
-        "task_name": "string",
-        "description": "string",
-        "estimated_hours": number,
-        "hourly_rate": number,
-        "total_cost": number,
-        "complexity": "low|medium|high"
-      }}
-    ],
-    "total_hours": number,
-    "total_cost": number
-  }},
-  "backend": {{
-    "tasks": [
-      {{
-        "task_name": "string",
-        "description": "string",
-        "estimated_hours": number,
-        "hourly_rate": number,
-        "total_cost": number,
-        "complexity": "low|medium|high"
-      }}
-    ],
-    "total_hours": number,
-    "total_cost": number
-  }},
-  "ai_tasks": {{
-    "tasks": [
-      {{
-        "task_name": "string",
-        "description": "string",
-        "estimated_hours": number,
-        "hourly_rate": number,
-        "total_cost": number,
-        "complexity": "low|medium|high"
-      }}
-    ],
-    "total_hours": number,
-    "total_cost": number
-  }},
-  "infrastructure": {{
-    "items": [
-      {{
-        "item_name": "string",
-        "description": "string",
-        "monthly_cost": number,
-        "estimated_months": number,
-        "total_cost": number
-      }}
-    ],
-    "total_cost": number
-  }},
-  "total_project_cost": number,
-  "estimated_weeks": number
-}}
-
-Consider:
+COST_ESTIMATION_GUIDELINES = """Consider:
 - Developer hourly rates (vary by role: frontend, backend, AI/ML)
 - Infrastructure costs (hosting, databases, APIs, etc.)
 - Third-party service costs
 - Buffer for unexpected costs (add 15-20% contingency)
 
-Use reasonable hourly rates based on typical market rates for the tech stack.
-
-Return ONLY valid JSON, no markdown formatting or additional text."""
-
+Use reasonable hourly rates based on typical market rates for the tech stack."""
+
+TIME_ESTIMATION_PROMPT = (
+    "Based on the PRD and project metadata above, generate a detailed time estimation breakdown "
+    "and record it with the record_time_estimates tool.\n\n"
+    + TIME_ESTIMATION_GUIDELINES
+)
+
+COST_ESTIMATION_PROMPT = (
+    "Based on the PRD and project metadata above, generate a detailed cost estimation breakdown "
+    "and record it with the record_cost_estimates tool.\n\n"
+    + COST_ESTIMATION_GUIDELINES
+)
+
+# Time and cost estimates in one call: the PRD is processed once and both breakdowns stay consistent
+COMBINED_ESTIMATION_PROMPT = (
+    "Based on the PRD and project metadata above, generate a detailed time estimation breakdown "
+    "and a detailed cost estimation breakdown, and record both with the record_estimates tool.\n\n"
+    "For the time estimates:\n"
+    + TIME_ESTIMATION_GUIDELINES + "\n\n"
+    "For the cost estimates:\n"
+    + COST_ESTIMATION_GUIDELINES + "\n\n"
+    "Use the same tasks and estimated_weeks in both estimates, and keep task descriptions brief."
+)
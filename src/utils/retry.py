@@ -0,0 +1,92 @@
+"""
+Exponential-backoff retries for rate-limited or transiently failing LLM calls
+"""
+import time
+import random
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional, Tuple, Type, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Attempts made for a failing call before the error is raised to the caller
+RATE_LIMIT_RETRIES = 3
+
+# Status codes the provider SDKs retry besides 429/5xx: request timeout and lock conflict
+RETRYABLE_STATUS_CODES = (408, 409)
+
+# Longest server-requested wait that is honoured; longer ones fall back to backoff (as in the SDKs)
+MAX_RETRY_AFTER = 60.0
+
+
+def _backoff_delay(attempt: int, base_delay: float) -> float:
+    """Exponential delay for a retry attempt, with jitter so clients don't retry in lockstep"""
+    return base_delay * 2 ** attempt + random.uniform(0, 0.5)
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked to wait via retry-after-ms / retry-after, if it sent them"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        # HTTP-date form
+        return parsedate_to_datetime(retry_after).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+
+async def with_retry_async(
+    fn: Callable[[], Awaitable[T]],
+    retry_on: Tuple[Type[BaseException], ...],
+    retries: int = RATE_LIMIT_RETRIES,
+    base_delay: float = 1.0,
+    retry_statuses: Tuple[int, ...] = RETRYABLE_STATUS_CODES
+) -> T:
+    """
+    Await fn(), retrying with exponential backoff when it raises one of retry_on
+    
+    A retry-after-ms / retry-after header on the error's response takes precedence
+    over the backoff delay when it asks for at most MAX_RETRY_AFTER seconds.
+    
+    Args:
+        fn: Zero-argument callable returning the request coroutine
+        retry_on: Exception types that trigger a retry (e.g. the SDK's RateLimitError)
+        retries: Total number of attempts
+        base_delay: Delay in seconds before the first retry; doubles on each attempt
+        retry_statuses: Also retry errors carrying one of these HTTP status codes
+        
+    Returns:
+        The result of fn; the last error is re-raised once attempts run out
+    """
+    for attempt in range(retries):
+        try:
+            return await fn()
+        except Exception as e:
+            retryable = isinstance(e, retry_on) or getattr(e, "status_code", None) in retry_statuses
+            if not retryable or attempt == retries - 1:
+                raise
+            delay = _retry_after(e)
+            if delay is None or not 0 <= delay <= MAX_RETRY_AFTER:
+                delay = _backoff_delay(attempt, base_delay)
+            logger.warning("Request failed, retrying in %.1fs (attempt %d/%d): %s", delay, attempt + 1, retries, e)
+            await asyncio.sleep(delay)